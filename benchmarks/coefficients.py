@@ -0,0 +1,79 @@
+"""Time-dependent coefficient benchmark: Python callback vs precomputed array.
+
+Runs ``qutip.mesolve`` for every waveform with and without noise, once with
+the per-step ``periodic(t, args)`` callback the Simulation page used to build
+and once with the vectorized array coefficient from ``engine.waveform``.
+
+    python -m benchmarks.coefficients [--num-qubit 4] [--T 1] [--repeat 3]
+"""
+import argparse
+import time
+
+import numpy as np
+import qutip
+from scipy.interpolate import interp1d
+
+import engine
+from engine import hamiltonian
+from engine.waveform import drive_samples, interpolation_order, noise_signal, shape
+
+
+def callback_coefficient(params):
+    """The original scalar ``periodic(t, args)`` closure."""
+    times = engine.time_grid(params.T)
+    if params.noise_std:
+        noise_sig = noise_signal(params, times)
+        noise_interp = interp1d(
+            times,
+            noise_sig,
+            bounds_error=False,
+            fill_value=(noise_sig[0], noise_sig[-1])
+        )
+
+    def periodic(t, args):
+        H = params.B0+params.amp*shape(params, t)
+        if params.noise_std:
+            H = H+noise_interp(t)
+        return H
+    return periodic
+
+
+def run(params, coefficient, order=3):
+    times = engine.time_grid(params.T)
+    H = qutip.QobjEvo(
+        [[hamiltonian.drive_operator(params.num_qubit), coefficient],
+         hamiltonian.static_hamiltonian(params)],
+        tlist=times, order=order,
+    )
+    start = time.perf_counter()
+    result = qutip.mesolve(H, hamiltonian.initial_state(params), times,
+                           e_ops=[hamiltonian.observable(params)])
+    return time.perf_counter() - start, np.real(result.expect[0])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--num-qubit", type=int, default=4)
+    parser.add_argument("--T", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'waveform':<10}{'noise':<7}{'callback [s]':>14}{'array [s]':>12}{'speedup':>10}{'max |diff|':>13}")
+    for waveform in engine.params.WAVEFORMS:
+        for noise_std in (0, 100):
+            params = engine.make_params(
+                "1D", args.num_qubit, B0=1500, amp=300, f=10, J=10, T=args.T,
+                grad=100, waveform=waveform, duty=0.3, w=0.4,
+                noise_std=noise_std, noise_seed=0,
+            )
+            times = engine.time_grid(params.T)
+            slow = min(run(params, callback_coefficient(params)) for _ in range(args.repeat))
+            fast = min(run(params, drive_samples(params, times), interpolation_order(params))
+                       for _ in range(args.repeat))
+            diff = np.max(np.abs(slow[1] - fast[1]))
+            print(f"{waveform:<10}{'on' if noise_std else 'off':<7}"
+                  f"{slow[0]:>14.3f}{fast[0]:>12.3f}{slow[0]/fast[0]:>9.1f}x{diff:>13.2e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,279 @@
+"""Benchmark suite for the sonification pipeline, with JSON results.
+
+Renders the settings the Simulation page offers without Streamlit under
+:func:`engine.metrics.recording`, in three top-level stages:
+
+``setup``
+    choosing the backend;
+``solve``
+    drawing the expectation values from :func:`engine.solver.iter_solve`;
+``encode``
+    running-peak normalization and 16-bit PCM.
+
+``stages`` also holds the engine's own nested stages (``operators``,
+``traces``, ``resample``, ...), each with its wall time, call count and
+growth of the peak resident memory.  Every case runs in a fresh worker
+process, so ``peak_rss_mb`` is the memory high-water mark of that case
+alone over the interpreter with the engine imported.  ``steps`` counts
+the solver's work: samples the trace backends actually solved (coarse
+grid and full-rate head), blocks, and for the matrix-free backend the
+applications of the static Hamiltonian.  ``resample`` is the coarse grid
+and error bound the render was solved with.  ``error`` is the largest deviation from a
+tight-tolerance ``mesolve``, an integration independent of every fast
+backend; it is only computed up to :data:`REFERENCE_QUBITS` spins and is
+None above, where those cases are timed only.
+
+By default each geometry is rendered at a base setting and then with one
+knob changed at a time; ``--full`` takes every combination instead.
+
+    python -m benchmarks.suite [--full] [--num-qubit 1 2 3 4 6 8] [--out results.json]
+    python -m benchmarks.suite --compare old.json new.json
+"""
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import qutip
+import scipy
+
+import engine
+from engine import closed_form, hamiltonian, matrix_free, metrics, solver, symmetry
+from engine.audio import Limiter
+from engine.params import SAMPLE_RATE, num_samples, time_grid
+from engine.stream import BLOCK_SECONDS
+
+BASE = dict(T=1, waveform="sine", noise=False, open=False, observable="prod")
+AXES = dict(
+    T=(1, 5),
+    waveform=("sine", "square", "sawtooth"),
+    noise=(False, True),
+    open=(False, True),
+    observable=("prod", "sum"),
+)
+LATTICES = ((2, 2), (3, 3))
+# Deviation from the reference that fails a case.
+TOLERANCE = 1e-6
+# Largest system the reference mesolve integrates within TOLERANCE.
+REFERENCE_QUBITS = 8
+TRACE_BACKENDS = (closed_form, symmetry, matrix_free)
+# Slowdown of a stage that --compare reports as a regression.
+REGRESSION = 1.2
+
+
+def case_settings(num_qubits, lattices, full=False):
+    """Keyword settings of every case, see :func:`make_case`."""
+    geometries = [dict(dim="1D", num_qubit=n) for n in num_qubits]
+    geometries += [dict(dim="2D", num_qubit=lx*ly, size=(lx, ly)) for lx, ly in lattices]
+    for geometry in geometries:
+        if full:
+            for values in itertools.product(*AXES.values()):
+                yield {**geometry, **dict(zip(AXES, values))}
+            continue
+        yield {**geometry, **BASE}
+        for axis, options in AXES.items():
+            for value in options:
+                if value != BASE[axis]:
+                    yield {**geometry, **BASE, axis: value}
+
+
+def case_name(settings):
+    geometry = (f"{settings['size'][0]}x{settings['size'][1]}" if settings["dim"] == "2D"
+                else f"{settings['num_qubit']}")
+    return "-".join([settings["dim"], geometry, f"T{settings['T']}", settings["waveform"],
+                     "noise" if settings["noise"] else "clean",
+                     "open" if settings["open"] else "closed", settings["observable"]])
+
+
+def make_case(settings):
+    """The :class:`~engine.params.SimParams` the page builds for ``settings``."""
+    return engine.make_params(
+        dim=settings["dim"], num_qubit=settings["num_qubit"], size=settings.get("size"),
+        B0=1500, amp=300, f=10, J=10, T=settings["T"],
+        grad=100, gradx=100, grady=50,
+        waveform=settings["waveform"], duty=0.3, w=0.4,
+        noise_std=100 if settings["noise"] else 0, noise_seed=0,
+        decoherence="both" if settings["open"] else None, gamma=1.0,
+        observable=settings["observable"],
+    )
+
+
+def reference(params):
+    """Expectation values to judge accuracy by, and where they came from.
+
+    None for both above :data:`REFERENCE_QUBITS` spins.
+    """
+    if params.num_qubit > REFERENCE_QUBITS:
+        return None, None
+    times = time_grid(params.T)
+    result = qutip.mesolve(hamiltonian.evolution_hamiltonian(params, times),
+                           hamiltonian.initial_state(params), times,
+                           c_ops=hamiltonian.collapse_operators(params),
+                           e_ops=[hamiltonian.observable(params)],
+                           options={"atol": 1e-12, "rtol": 1e-10, "nsteps": 10**6})
+    return np.real(result.expect[0]), "mesolve"
+
+
+def _counting(backend, counts):
+    """``backend.iter_traces`` adding the samples it yields to ``counts["points"]``."""
+    iter_traces = backend.iter_traces
+
+    def wrapper(*args, **kwargs):
+        for chunk in iter_traces(*args, **kwargs):
+            counts["points"] += len(chunk[0])
+            yield chunk
+    return wrapper
+
+
+def run_case(settings, method="auto"):
+    """Render one case and measure it; runs in its own worker process."""
+    baseline = metrics.peak_rss()
+    params = make_case(settings)
+    counts = {"points": 0, "hamiltonian_applications": 0}
+    apply_static = matrix_free.apply_static
+
+    def counting(*args):
+        counts["hamiltonian_applications"] += 1
+        return apply_static(*args)
+    matrix_free.apply_static = counting
+    # Every sample the trace backends solve, on the coarse grid and the
+    # full-rate head alike; the mesolve family solves the audio grid.
+    for module in TRACE_BACKENDS:
+        module.iter_traces = _counting(module, counts)
+
+    with metrics.recording() as recorder:
+        with metrics.stage("setup"):
+            backend = solver.resolve_method(params, method)
+            blocks = iter(solver.iter_solve(params, backend, int(BLOCK_SECONDS*SAMPLE_RATE)))
+        limiter = Limiter()
+        expectation, pcm = [], []
+        while True:
+            with metrics.stage("solve"):
+                block = next(blocks, None)
+            if block is None:
+                break
+            with metrics.stage("encode"):
+                pcm.append(limiter.pcm16(block).astype("<i2").tobytes())
+            expectation.append(block)
+    stats = recorder.summary()
+    matrix_free.apply_static = apply_static
+    if backend not in ("closed_form", "symmetry", "matrix_free"):
+        counts["points"] = num_samples(params.T)
+
+    expectation = np.concatenate(expectation)
+    ref, source = reference(params)
+    error = None if ref is None else float(np.abs(expectation - ref).max())
+    return {
+        "name": case_name(settings),
+        "settings": settings,
+        "method": backend,
+        "stages": stats["stages"],
+        "wall": stats["seconds"],
+        "peak_rss_mb": (stats["peak_rss_bytes"] - baseline)/2**20,
+        "steps": {"blocks": len(pcm), **counts},
+        "error": error,
+        "reference": source,
+        "resample": stats["notes"].get("resample"),
+        "ok": error is None or error <= TOLERANCE,
+    }
+
+
+def _commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True, cwd=os.path.dirname(__file__)).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def metadata():
+    return {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": _commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "numpy": np.__version__,
+        "scipy": scipy.__version__,
+        "qutip": qutip.__version__,
+    }
+
+
+def _error(case):
+    return "-" if case["error"] is None else f"{case['error']:.1e}"
+
+
+def run(settings, method="auto"):
+    """Results of every case in ``settings``, each in a fresh process."""
+    context = multiprocessing.get_context("spawn")
+    cases = []
+    with ProcessPoolExecutor(1, mp_context=context, max_tasks_per_child=1) as executor:
+        for result in executor.map(run_case, settings, itertools.repeat(method)):
+            cases.append(result)
+            print(f"{result['name']:<44}{result['method']:<13}{result['wall']:>9.3f}s"
+                  f"{result['peak_rss_mb']:>9.1f} MiB{_error(result):>11}"
+                  f"{'' if result['ok'] else '  FAIL'}", flush=True)
+    return {"meta": metadata(), "method": method, "cases": cases}
+
+
+def compare(old, new):
+    """Print stage times of ``new`` against ``old`` and return the regressions."""
+    before = {case["name"]: case for case in old["cases"]}
+    regressions = []
+    print(f"{'case':<44}{'stage':<11}{'old [s]':>10}{'new [s]':>10}{'ratio':>8}")
+    for case in new["cases"]:
+        previous = before.get(case["name"])
+        if previous is None:
+            continue
+        for stage, entry in case["stages"].items():
+            seconds = entry["seconds"]
+            was = previous["stages"].get(stage, {}).get("seconds")
+            if not was:
+                continue
+            ratio = seconds/was
+            flag = ""
+            if ratio > REGRESSION and seconds - was > 0.01:
+                regressions.append((case["name"], stage, ratio))
+                flag = "  slower"
+            print(f"{case['name']:<44}{stage:<11}{was:>10.3f}{seconds:>10.3f}{ratio:>7.2f}x{flag}")
+        if case["error"] is not None and case["error"] > max(previous["error"] or 0, TOLERANCE):
+            regressions.append((case["name"], "error", case["error"]))
+            print(f"{case['name']:<44}error      {_error(previous):>10}{_error(case):>10}  less accurate")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.suite",
+                                     description=__doc__.splitlines()[0])
+    parser.add_argument("--num-qubit", type=int, nargs="*", default=[1, 2, 3, 4, 6, 8])
+    parser.add_argument("--lattice", nargs="*", default=[f"{lx}x{ly}" for lx, ly in LATTICES],
+                        help="2D lattice sizes, e.g. 2x2 3x3")
+    parser.add_argument("--full", action="store_true", help="every combination of the knobs")
+    parser.add_argument("--method", default="auto")
+    parser.add_argument("--out", default="benchmark.json")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"),
+                        help="compare two result files instead of running")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        old, new = (json.load(open(path)) for path in args.compare)
+        sys.exit(1 if compare(old, new) else 0)
+
+    lattices = [tuple(int(n) for n in size.split("x")) for size in args.lattice]
+    results = run(list(case_settings(args.num_qubit, lattices, args.full)), args.method)
+    with open(args.out, "w") as f:
+        json.dump(results, f, indent=1)
+    failed = [case["name"] for case in results["cases"] if not case["ok"]]
+    print(f"{len(results['cases'])} cases written to {args.out}, {len(failed)} failed")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+"""Headless simulation engine behind the Simulation page.
+
+The names below are imported from their submodules on first use, so
+importing the package costs next to nothing.  ``qutip``, ``scipy.signal``
+and ``soundfile`` load only once a render or an encode actually starts.
+"""
+import importlib
+
+_EXPORTS = {
+    "FORMATS": "audio", "Mix": "audio", "make_mix": "audio",
+    "LRUCache": "cache", "process_cache": "cache",
+    "RenderPool": "jobs",
+    "SAMPLE_RATE": "params", "SimParams": "params", "make_params": "params", "time_grid": "params",
+    "Render": "pipeline", "lookup": "pipeline", "remember": "pipeline", "render": "pipeline",
+    "render_key": "pipeline",
+    "render_preview": "preview",
+    "METHODS": "solver", "iter_solve": "solver", "solve": "solver",
+    "wav_chunks": "stream", "wav_header": "stream",
+    "run_sweep": "sweep",
+}
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{_EXPORTS[name]}", __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_EXPORTS))
@@ -0,0 +1,144 @@
+import hashlib
+import io
+from typing import NamedTuple
+
+import numpy as np
+
+from . import metrics
+from .params import SAMPLE_RATE
+
+# name: (container, subtype, MIME type, file extension)
+FORMATS = {
+    "wav": ("WAV", "PCM_16", "audio/wav", "wav"),
+    "wav24": ("WAV", "PCM_24", "audio/wav", "wav"),
+    "wav8": ("WAV", "PCM_U8", "audio/wav", "wav"),
+    "flac": ("FLAC", "PCM_16", "audio/flac", "flac"),
+    "ogg": ("OGG", "VORBIS", "audio/ogg", "ogg"),
+    "opus": ("OGG", "OPUS", "audio/ogg", "opus"),
+}
+# The only rate of Opus near the audio rate.
+OPUS_RATE = 48000
+# Samples normalized and written per step of :func:`encode`.
+ENCODE_BLOCK = 2**16
+
+
+def pan_gains(positions, channels=2):
+    """Constant-power gains placing each voice at a position in ``[0, channels - 1]``.
+
+    A voice between two neighbouring channels is split between them with
+    cosine/sine weights, so its loudness does not depend on where it sits.
+    """
+    positions = np.clip(np.asarray(positions, dtype=float), 0, channels - 1)
+    gains = np.zeros((len(positions), channels))
+    if channels == 1:
+        gains[:] = 1
+        return gains
+    lower = np.minimum(positions.astype(int), channels - 2)
+    angle = (positions - lower)*np.pi/2
+    rows = np.arange(len(positions))
+    gains[rows, lower] = np.cos(angle)
+    gains[rows, lower + 1] = np.sin(angle)
+    return gains
+
+
+class Mix(NamedTuple):
+    """Observables voiced together, with one row of channel gains each."""
+    observables: tuple
+    gains: tuple
+
+    @property
+    def channels(self):
+        return len(self.gains[0])
+
+    def key(self):
+        return hashlib.sha1(repr(self).encode()).hexdigest()
+
+    def matrix(self):
+        return np.array(self.gains)
+
+
+def make_mix(observables, channels=2, positions=None):
+    """A :class:`Mix` spreading ``observables`` evenly across ``channels``.
+
+    ``positions`` overrides the placement, one value in
+    ``[0, channels - 1]`` per observable (0 is hard left in stereo).
+    """
+    observables = tuple(observables)
+    if not observables:
+        raise ValueError("a mix needs at least one observable")
+    if positions is None:
+        positions = (np.linspace(0, channels - 1, len(observables)) if len(observables) > 1
+                     else [(channels - 1)/2])
+    if len(positions) != len(observables):
+        raise ValueError("give one position per observable")
+    gains = pan_gains(positions, channels)
+    return Mix(observables, tuple(tuple(row) for row in gains.tolist()))
+
+
+class Limiter:
+    """Running-peak normalization of a signal that arrives in blocks.
+
+    Each sample is divided by the largest magnitude seen so far, so blocks
+    can be converted as soon as they are computed.  Blocks of shape
+    ``(samples, channels)`` share one peak across channels.  With ``release < 1`` the
+    held peak decays by that factor per second of audio, letting quiet
+    passages after a loud onset recover their level.
+    """
+
+    def __init__(self, samplerate=SAMPLE_RATE, release=1.0):
+        self.log_decay = np.log(release)/samplerate
+        self.peak = 0.0
+
+    def __call__(self, block):
+        # Held peak at sample k: max over j <= k of |x_j| decayed by k - j
+        # samples, and the peak carried in decayed by k + 1, in log space.
+        k = np.arange(len(block))
+        magnitude = np.abs(block) if block.ndim == 1 else np.abs(block).max(axis=1, initial=0)
+        with np.errstate(divide="ignore"):
+            logs = np.log(magnitude) - k*self.log_decay
+            carried = np.log(self.peak) + self.log_decay
+        peaks = np.exp(np.maximum.accumulate(np.maximum(logs, carried)) + k*self.log_decay)
+        if len(peaks):
+            self.peak = peaks[-1]
+        if block.ndim > 1:
+            peaks = peaks[:, None]
+        return np.divide(block, peaks, out=np.zeros(block.shape), where=peaks > 0)
+
+    def pcm16(self, block):
+        with metrics.stage("normalize"):
+            block = self(block)
+        with metrics.stage("pcm16"):
+            return np.int16(block*32767)
+
+
+def encode(signal, fmt="wav", samplerate=SAMPLE_RATE):
+    """``signal`` normalized by a :class:`Limiter` and encoded as ``fmt``.
+
+    ``fmt`` is a key of :data:`FORMATS`; ``signal`` has one sample per row
+    and, for several channels, one column per channel.
+    Blocks of the array are normalized and handed to libsndfile one at a
+    time, so apart from the encoded bytes no full-length copy is made; 16-bit
+    formats get the same samples as the streamed PCM.  Opus only takes
+    48 kHz and is resampled in one piece.
+    """
+    import soundfile as sf
+    from scipy.signal import resample_poly
+
+    container, subtype, _, _ = FORMATS[fmt]
+    channels = 1 if signal.ndim == 1 else signal.shape[1]
+    rate = OPUS_RATE if subtype == "OPUS" else samplerate
+    limiter = Limiter(samplerate)
+    buffer = io.BytesIO()
+    with metrics.stage("encode"), sf.SoundFile(buffer, "w", rate, channels, subtype,
+                                               format=container) as f:
+        blocks = []
+        for start in range(0, len(signal), ENCODE_BLOCK):
+            block = signal[start:start + ENCODE_BLOCK]
+            if subtype == "OPUS":
+                blocks.append(limiter(block))
+            else:
+                f.write(limiter.pcm16(block) if subtype == "PCM_16" else limiter(block))
+        if blocks:
+            whole = resample_poly(np.concatenate(blocks), OPUS_RATE, samplerate, axis=0)
+            f.write(np.clip(whole, -1, 1))
+    return buffer.getvalue()
@@ -0,0 +1,198 @@
+"""Pre-rendered sound bank for the deterministic part of the parameter grid.
+
+Every control on the Simulation page is a discrete slider, so noise-free
+renders from the default initial state form a finite grid.  ``build``
+renders a slice of that grid over a process pool into a directory holding
+
+``samples.f32``
+    the expectation values of every entry back to back, as raw float32;
+``index.npy``
+    a record array of ``(key, offset, length)`` sorted by
+    :meth:`~engine.params.SimParams.key`, located by binary search;
+``meta.json``
+    the sample rate and entry count.
+
+Both arrays are opened memory-mapped, so a lookup reads only the index
+pages it bisects and hands back a read-only view of the samples without
+copying them.
+
+Build from the command line, e.g.::
+
+    python -m engine.bank soundbank --chain 1 2 3 4 --T 1 2 --B0 1000 1500 2000
+
+Axes not given stay at the page's initial setting; ``--full`` takes every
+option of every axis instead, which for one chain length is already about
+two hundred thousand renders.
+"""
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .params import OBSERVABLES, SAMPLE_RATE, make_params
+from .pipeline import Render
+
+# The options of the Simulation page's sliders.
+GRID = {
+    "T": (1, 2, 3, 4, 5, 10, 30, 60),
+    "B0": (1000, 1100, 1200, 1300, 1400, 1500, 1600, 1700, 1800, 1900, 2000),
+    "grad": (0, 100, 150, 200, 250, 300),
+    "amp": (0, 100, 200, 300, 400, 500, 600),
+    "f": (5, 10, 15, 20, 25, 30),
+    "J": (-20, -10, 0, 10, 20),
+    "duty": (0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9),
+    "w": (0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0),
+}
+# The page's initial setting: the first option of every slider.
+DEFAULTS = {axis: options[:1] for axis, options in GRID.items()}
+INDEX_DTYPE = np.dtype([("key", "S40"), ("offset", "<i8"), ("length", "<i8")])
+
+
+class SoundBank:
+    """Read-only view of a bank directory written by :func:`build`."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        self.index = np.load(os.path.join(path, "index.npy"), mmap_mode="r")
+        samples = os.path.join(path, "samples.f32")
+        self.samples = (np.memmap(samples, dtype="<f4", mode="r")
+                        if os.path.getsize(samples) else np.zeros(0, dtype="<f4"))
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, params):
+        return self._find(params.key()) is not None
+
+    def _find(self, key):
+        key = key.encode()
+        i = np.searchsorted(self.index["key"], key)
+        if i < len(self.index) and self.index["key"][i] == key:
+            return self.index[i]
+        return None
+
+    def get(self, params):
+        """Expectation values of ``params`` as a memory-mapped view, or None."""
+        entry = self._find(params.key())
+        if entry is None:
+            return None
+        return self.samples[entry["offset"]:entry["offset"] + entry["length"]]
+
+    def render(self, params):
+        """A :class:`~engine.pipeline.Render` served from the bank, or None."""
+        signal = self.get(params)
+        if signal is None:
+            return None
+        return Render(signal, samplerate=self.meta["samplerate"])
+
+
+def _geometries(chains, lattices, periodic):
+    for n in chains:
+        yield dict(dim="1D", num_qubit=n)
+    for lx, ly in lattices:
+        for p in periodic:
+            yield dict(dim="2D", num_qubit=lx*ly, size=(lx, ly), periodic=p)
+
+
+def _waveforms(waveforms, grid):
+    for waveform in waveforms:
+        if waveform == "square":
+            yield from (dict(waveform=waveform, duty=d) for d in grid["duty"])
+        elif waveform == "sawtooth":
+            yield from (dict(waveform=waveform, w=w) for w in grid["w"])
+        else:
+            yield dict(waveform=waveform)
+
+
+def grid_params(chains=(1,), lattices=(), periodic=(False, True), waveforms=("sine",),
+                observables=OBSERVABLES, **axes):
+    """Every :class:`SimParams` of the grid, with ``axes`` replacing :data:`DEFAULTS`.
+
+    Pass ``**GRID`` for the whole grid.  2D lattices take their ``gradx``
+    and ``grady`` from the ``grad`` axis.  Settings that normalize to the
+    same parameters are yielded once.
+    """
+    grid = {**DEFAULTS, **axes}
+    seen = set()
+    common = itertools.product(grid["T"], grid["B0"], grid["amp"], grid["f"], grid["J"],
+                               observables, list(_waveforms(waveforms, grid)))
+    for geometry, (T, B0, amp, f, J, observable, shape) in itertools.product(
+            list(_geometries(chains, lattices, periodic)), common):
+        if geometry["dim"] == "1D":
+            gradients = [dict(grad=g) for g in grid["grad"]]
+        else:
+            gradients = [dict(gradx=gx, grady=gy) for gx in grid["grad"] for gy in grid["grad"]]
+        for gradient in gradients:
+            params = make_params(B0=B0, amp=amp, f=f, J=J, T=T, observable=observable,
+                                 **geometry, **shape, **gradient)
+            key = params.key()
+            if key not in seen:
+                seen.add(key)
+                yield params
+
+
+def _render(params):
+    from .solver import solve
+
+    return params.key(), solve(params).astype("<f4")
+
+
+def build(path, params, workers=None, executor=None):
+    """Render every entry of ``params`` into a new bank at ``path``."""
+    os.makedirs(path, exist_ok=True)
+    entries = []
+    offset = 0
+    own = executor is None
+    if own:
+        executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"))
+    try:
+        with open(os.path.join(path, "samples.f32"), "wb") as samples:
+            for key, expectation in executor.map(_render, params, chunksize=4):
+                samples.write(expectation.tobytes())
+                entries.append((key.encode(), offset, len(expectation)))
+                offset += len(expectation)
+    finally:
+        if own:
+            executor.shutdown(cancel_futures=True)
+    index = np.array(sorted(entries), dtype=INDEX_DTYPE)
+    np.save(os.path.join(path, "index.npy"), index)
+    with open(os.path.join(path, "meta.json"), "w") as f:
+        json.dump({"samplerate": SAMPLE_RATE, "entries": len(index)}, f)
+    return SoundBank(path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m engine.bank", description=__doc__.split("\n\n")[0])
+    parser.add_argument("path")
+    parser.add_argument("--chain", type=int, nargs="*", default=[1], help="1D chain lengths")
+    parser.add_argument("--lattice", nargs="*", default=[], help="2D lattice sizes, e.g. 2x2 2x3")
+    parser.add_argument("--waveform", nargs="*", default=["sine"], choices=("sine", "square", "sawtooth"))
+    parser.add_argument("--observable", nargs="*", default=list(OBSERVABLES), choices=OBSERVABLES)
+    for axis, options in GRID.items():
+        parser.add_argument(f"--{axis}", type=type(options[0]), nargs="*", default=None,
+                            help=f"options of {axis} (default {DEFAULTS[axis][0]}, one of {list(options)})")
+    parser.add_argument("--full", action="store_true", help="every option of the axes not given")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    base = GRID if args.full else DEFAULTS
+    params = list(grid_params(
+        chains=args.chain,
+        lattices=[tuple(int(n) for n in size.split("x")) for size in args.lattice],
+        waveforms=args.waveform, observables=args.observable,
+        **{axis: base[axis] if getattr(args, axis) is None else getattr(args, axis) for axis in GRID},
+    ))
+    size = sum(4*SAMPLE_RATE*entry.T for entry in params)
+    print(f"rendering {len(params)} entries ({size/2**30:.2f} GiB) into {args.path}")
+    bank = build(args.path, params, workers=args.workers)
+    print(f"{len(bank)} entries, {bank.samples.nbytes/2**20:.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+OPERATOR_CACHE_ENV = "QMUSIC_OPERATOR_CACHE"
+# Bumped whenever the arrays stored for an operator change.
+OPERATOR_CACHE_VERSION = 1
+# Memory the renders of the process-wide cache may hold, encoded files included.
+PROCESS_CACHE_BYTES = 512*2**20
+
+
+def nbytes(value):
+    """Memory held by a cached value: its ``nbytes`` if it has one, else 0."""
+    return getattr(value, "nbytes", 0)
+
+
+class LRUCache:
+    """Thread-safe, size-bounded mapping that evicts the least recently used entry.
+
+    Besides ``maxsize`` entries, ``maxbytes`` bounds their total
+    :func:`nbytes`.  Values may grow while cached (a render encodes
+    formats on request), so the total is measured again on every access;
+    the most recent entry is always kept.
+    """
+
+    def __init__(self, maxsize, maxbytes=None):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _evict(self):
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+        if self.maxbytes is None:
+            return
+        total = sum(nbytes(value) for value in self._data.values())
+        while total > self.maxbytes and len(self._data) > 1:
+            total -= nbytes(self._data.popitem(last=False)[1])
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            self._evict()
+            return self._data[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            self._evict()
+
+    @property
+    def nbytes(self):
+        with self._lock:
+            return sum(nbytes(value) for value in self._data.values())
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._data
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+
+# Shared by every session served from this process.
+process_cache = LRUCache(32, PROCESS_CACHE_BYTES)
+
+
+def operator_dir():
+    """Directory of the on-disk operator cache, or None if it is switched off.
+
+    ``$QMUSIC_OPERATOR_CACHE`` names it; unset, it lives in the temporary
+    directory so the worker processes of one host share it, and set to an
+    empty string it is off.  Point it at a volume baked into a container
+    image to skip operator assembly on cold starts.
+    """
+    path = os.environ.get(OPERATOR_CACHE_ENV)
+    if path is None:
+        path = os.path.join(tempfile.gettempdir(), "qmusic-operators")
+    return os.path.join(path, f"v{OPERATOR_CACHE_VERSION}") if path else None
+
+
+def cached_arrays(name, build):
+    """The dict of arrays ``build()`` returns, kept on disk under ``name``.
+
+    The first call in any process builds and stores them; later calls
+    memory-map the stored files copy-on-write, so a process only reads the
+    pages it touches and may still modify its view.  Entries are written
+    to a scratch directory and renamed into place, so concurrent builders
+    never expose a partial entry.  Without a writable cache directory the
+    arrays are just built.
+    """
+    root = operator_dir()
+    if root is None:
+        return build()
+    path = os.path.join(root, name)
+    if not os.path.isdir(path):
+        arrays = build()
+        scratch = None
+        try:
+            os.makedirs(root, exist_ok=True)
+            scratch = tempfile.mkdtemp(prefix=f"{name}.", dir=root)
+            for key, value in arrays.items():
+                np.save(os.path.join(scratch, f"{key}.npy"), value)
+            os.rename(scratch, path)
+        except OSError:
+            # Read-only, or another process stored the entry first.
+            if scratch is not None:
+                shutil.rmtree(scratch, ignore_errors=True)
+            if not os.path.isdir(path):
+                return arrays
+    return {entry[:-4]: np.load(os.path.join(path, entry), mmap_mode="c")
+            for entry in os.listdir(path) if entry.endswith(".npy")}
@@ -0,0 +1,176 @@
+"""Closed-form evolution for Hamiltonians that commute with the drive.
+
+Every static term of the model (Heisenberg bonds and z-gradients) commutes
+with the global parity ``P = sigma_z^{(1)} ... sigma_z^{(N)}`` that the
+drive couples to, so the propagator factorizes into
+``exp(-i Phi(t) P) exp(-i H0 t)`` with ``Phi`` the integrated drive.  One
+eigendecomposition of ``H0`` per parity sector then gives the state at
+every sample without an ODE solve.
+
+Both collapse operators of the app keep this structure.  Dephasing through
+``P`` itself only damps coherences between the two sectors.  The collective
+lowering operator ``|0...0><1...1|`` connects two states that hopping cannot
+touch, so they are eigenstates of ``H(t)``; in the rotating frame the master
+equation then only shrinks the ``|1...1>`` amplitude of the no-jump state by
+``exp(-gamma t / 2)`` and moves the lost population to ``|0...0>``.
+"""
+import numpy as np
+
+from . import hamiltonian, lattice, metrics
+from .params import audio_grid
+from .waveform import Drive
+
+# Dense per-sector eigendecomposition stops paying off beyond this size.
+MAX_QUBITS = 10
+# Upper bound on the number of complex amplitudes held per chunk of samples.
+CHUNK_ELEMENTS = 2**22
+# Upper bound on the samples per chunk, so the first audio arrives quickly.
+MAX_CHUNK_SAMPLES = 16384
+# Samples sharing one exact exponential of the block start time.
+BLOCK = 256
+
+
+def applicable(params, atol=1e-12):
+    """True if ``params`` can be evolved in closed form."""
+    if params.num_qubit > MAX_QUBITS:
+        return False
+    H0 = hamiltonian.static_matrix(params).tocoo()
+    s = lattice.parity(params.num_qubit)
+    if np.any(np.abs(H0.data[s[H0.row] != s[H0.col]]) > atol):
+        return False
+    if hamiltonian.damping_rates(params)[0]:
+        # |0...0> and |1...1> must be eigenstates of H0.
+        ends = np.isin(H0.row, (0, H0.shape[0] - 1)) & (H0.row != H0.col)
+        return not np.any(np.abs(H0.data[ends]) > atol)
+    return True
+
+
+def eigensystem(H0, s, isolate=None):
+    """Eigenpairs of ``H0`` restricted to each parity sector, embedded in the full space.
+
+    The basis state ``isolate``, if given, is known to be an eigenstate and is
+    returned as its own eigenvector so that degenerate partners cannot mix
+    into it.  Columns come grouped by sector, even parity first.
+    """
+    d = len(s)
+    energies, sectors, vectors = [], [], []
+    for sign in (1, -1):
+        idx = np.flatnonzero(s == sign)
+        idx = idx[idx != isolate]
+        E, V = np.linalg.eigh(H0[idx][:, idx].toarray())
+        full = np.zeros((d, len(idx)), dtype=complex)
+        full[idx] = V
+        if isolate is not None and s[isolate] == sign:
+            E = np.append(E, H0[isolate, isolate].real)
+            full = np.hstack([full, np.eye(d, 1, -isolate)])
+        energies.append(E)
+        sectors.append(np.full(len(E), sign))
+        vectors.append(full)
+    return np.concatenate(energies), np.concatenate(sectors), np.hstack(vectors)
+
+
+def iter_traces(params, observables=None, grid=None):
+    """Yield ``(times, same, cross)`` over consecutive chunks of the time grid.
+
+    The drive enters expectation values only through the phase between the
+    parity sectors: ``<O>(t) = same(t) + Re(exp(2i Phi(t)) cross(t))``, with
+    ``same`` and ``cross`` independent of the drive.  See :func:`with_drive`.
+
+    ``observables`` is a sequence of names understood by
+    :func:`engine.hamiltonian.observable_terms`; the traces then have one
+    row per observable.  The state is rebuilt once per chunk, and Pauli
+    strings of all observables that share an ``x`` mask share one product
+    of the state with its bit-flipped copy.
+
+    ``grid`` is a :class:`~engine.params.Grid` to evaluate on instead of
+    the audio grid of ``params.T``.
+    """
+    names = (params.observable,) if observables is None else tuple(observables)
+    n = params.num_qubit
+    s = lattice.parity(n)
+    top = len(s) - 1
+    gamma_amp, gamma = hamiltonian.damping_rates(params)
+    with metrics.stage("operators"):
+        E, sector, V = eigensystem(hamiltonian.static_matrix(params), s,
+                                   isolate=top if gamma_amp else None)
+    decaying = np.abs(V[top]) == 1 if gamma_amp else np.zeros(len(E), dtype=bool)
+
+    psi0 = np.asarray(params.initstate)
+    c = V.conj().T @ psi0
+    keep = np.abs(c) > 1e-14
+    E, sector, V, c, decaying = E[keep], sector[keep], V[:, keep], c[keep], decaying[keep]
+    even = np.count_nonzero(sector == 1)
+    rows_e, rows_o = np.flatnonzero(s == 1), np.flatnonzero(s == -1)
+    V_e, V_o = V[rows_e, :even], V[rows_o, even:]
+
+    # <psi|O_j|psi> = sum over masks x and states b of
+    # W_x[j, b] conj(psi[b^x]) psi[b].  A mask of odd weight flips parity;
+    # its b then only runs over the odd sector, with b^x even (the cross
+    # term), and the even-sector half is the complex conjugate.
+    with metrics.stage("operators"):
+        weights = hamiltonian.observable_weights(n, names)
+    masks = []
+    for x, W in weights.items():
+        rows = rows_o if bin(x).count("1") % 2 else np.arange(len(s))
+        masks.append((x, rows, rows ^ x, np.ascontiguousarray(W[:, rows])))
+    ground = weights[0][:, 0].real if 0 in weights else np.zeros(len(names))
+
+    # The grid is uniform, so exp(-i E t) at sample b*BLOCK + m is the
+    # product of a per-block and a per-offset factor: two small tables of
+    # exponentials instead of one per sample and eigenvalue.
+    grid = grid or audio_grid(params.T)
+    total, dt = grid.size, grid.step
+    offsets = np.exp(-1j*np.outer(np.arange(BLOCK)*dt, E))
+
+    step = min(MAX_CHUNK_SAMPLES, max(1, CHUNK_ELEMENTS // (BLOCK*len(s)))*BLOCK)
+    for start in range(0, total, step):
+        with metrics.stage("traces"):
+            times = grid.times(start, start+step)
+            k = len(times)
+            phases = c*np.exp(-1j*np.outer(np.arange(start, start+k, BLOCK)*dt, E))
+            amps = (phases[:, None, :]*offsets[None, :, :]).reshape(-1, len(c))[:k]
+            if decaying.any():
+                amps[:, decaying] *= np.exp(-gamma_amp*times[:, None]/2)
+            # Basis states along the rows, so every mask works on whole rows.
+            psi = np.empty((len(s), k), dtype=complex)
+            psi[rows_e] = V_e @ amps[:, :even].T
+            psi[rows_o] = V_o @ amps[:, even:].T
+            same = np.zeros((len(names), k))
+            cross = np.zeros((len(names), k), dtype=complex)
+            for x, rows, flipped, W in masks:
+                if x == 0:
+                    same += W.real @ (psi.real**2 + psi.imag**2)
+                elif len(rows) < len(s):
+                    cross += 2*(W @ (psi[flipped].conj()*psi[rows]))
+                else:
+                    same += (W @ (psi[flipped].conj()*psi)).real
+            if gamma:
+                cross *= np.exp(-2*gamma*times)
+            if gamma_amp:
+                jumped = abs(psi0[top])**2*(1 - np.exp(-gamma_amp*times))
+                same += np.outer(ground, jumped)
+        if observables is None:
+            yield times, same[0], cross[0]
+        else:
+            yield times, same, cross
+
+
+def with_drive(traces, params):
+    """Expectation values from ``(times, same, cross)`` chunks and the drive of ``params``."""
+    drive = Drive(params)
+    for times, same, cross in traces:
+        if cross is None:
+            yield same
+            continue
+        with metrics.stage("drive"):
+            expectation = same + (np.exp(2j*drive.block(times)[1])*cross).real
+        yield expectation
+
+
+def iter_solve(params, observables=None):
+    """Yield the expectation value over consecutive chunks of the time grid."""
+    return with_drive(iter_traces(params, observables), params)
+
+
+def solve(params, observables=None):
+    return np.concatenate(list(iter_solve(params, observables)), axis=-1)
@@ -0,0 +1,133 @@
+import functools
+import re
+
+import numpy as np
+import qutip
+from scipy import sparse
+
+from . import lattice
+from .cache import cached_arrays
+from .waveform import drive_samples, interpolation_order
+
+
+def geometry(params):
+    return lattice.Lattice(params.size[0], params.size[1], params.periodic)
+
+
+def gradient_field(params):
+    """Static z-field on each site from the spatial gradient."""
+    geo = geometry(params)
+    gx = params.grad if params.dim == "1D" else params.gradx
+    return [gx*x + params.grady*y for x, y in map(geo.coords, range(geo.num_sites))]
+
+
+def _qobj(matrix, num_qubit):
+    return qutip.Qobj(matrix, dims=[[2]*num_qubit, [2]*num_qubit])
+
+
+def static_matrix(params):
+    """Time-independent part of the Hamiltonian as a CSR matrix."""
+    return lattice.static_hamiltonian(geometry(params), params.J, gradient_field(params))
+
+
+def static_hamiltonian(params):
+    return _qobj(static_matrix(params), params.num_qubit)
+
+
+@functools.lru_cache(maxsize=8)
+def drive_operator(num_qubit):
+    return _qobj(sparse.diags(lattice.parity(num_qubit).astype(complex), format="csr"),
+                 num_qubit)
+
+
+def observable_terms(num_qubit, kind):
+    """Pauli strings of an observable, as :func:`lattice.assemble` terms.
+
+    ``kind`` is ``"prod"`` (the product of sigma_y), ``"sum"`` (the sum of
+    sigma_y), ``"parity"`` (the product of sigma_z), or a Pauli string
+    written as axis-site pairs, e.g. ``"x0"`` or ``"z0z1"``.
+    """
+    if kind == "prod":
+        return [(1, lattice.pauli_string(num_qubit, {i: "Y" for i in range(num_qubit)}))]
+    if kind == "sum":
+        return [(1, lattice.pauli_string(num_qubit, {i: "Y"})) for i in range(num_qubit)]
+    if kind == "parity":
+        return [(1, lattice.pauli_string(num_qubit, {i: "Z" for i in range(num_qubit)}))]
+    if not re.fullmatch(r"([xyz]\d+)+", kind):
+        raise ValueError(f"unknown observable {kind!r}")
+    ops = {}
+    for axis, site in re.findall(r"([xyz])(\d+)", kind):
+        site = int(site)
+        if site >= num_qubit or site in ops:
+            raise ValueError(f"invalid site {site} in observable {kind!r}")
+        ops[site] = axis.upper()
+    return [(1, lattice.pauli_string(num_qubit, ops))]
+
+
+@functools.lru_cache(maxsize=64)
+def observable_matrix(num_qubit, kind):
+    # Validates ``kind`` before it becomes part of a cache path.
+    terms = observable_terms(num_qubit, kind)
+    arrays = cached_arrays(f"observable-{num_qubit}-{kind}",
+                           lambda: lattice.csr_arrays("O", lattice.assemble(num_qubit, terms)))
+    return lattice.csr_from_arrays(arrays, "O", 2**num_qubit)
+
+
+def observable_weights(num_qubit, kinds):
+    """Pauli strings of several observables merged by ``x`` mask.
+
+    Returns ``{x: W}`` with ``<b^x| O_j |b> = W[j, b]`` for the ``j``-th
+    entry of ``kinds``, see :func:`lattice.mask_values`.
+    """
+    weights = {}
+    for j, kind in enumerate(kinds):
+        for x, v in lattice.mask_values(num_qubit, observable_terms(num_qubit, kind)).items():
+            weights.setdefault(x, np.zeros((len(kinds), 2**num_qubit), dtype=complex))[j] += v
+    return weights
+
+
+def observable_flips(num_qubit, kind):
+    """Whether the observable maps even-parity states to odd ones."""
+    return any(bin(x).count("1") % 2 for _, (x, _) in observable_terms(num_qubit, kind))
+
+
+def observable(params):
+    return _qobj(observable_matrix(params.num_qubit, params.observable), params.num_qubit)
+
+
+def collapse_operators(params):
+    d = 2**params.num_qubit
+    c_ops = []
+    for kind, gamma in params.c_ops:
+        if kind == "amplitude":
+            # sigma_minus on every site at once: |0...0><1...1|
+            lowering = sparse.csr_matrix(([1.0], ([0], [d-1])), shape=(d, d), dtype=complex)
+            c_ops.append(np.sqrt(gamma) * _qobj(lowering, params.num_qubit))
+        else:
+            c_ops.append(np.sqrt(gamma) * drive_operator(params.num_qubit))
+    return c_ops
+
+
+def damping_rates(params):
+    """``(gamma_amplitude, gamma_phase)`` of the collapse operators, zero if absent."""
+    rates = dict(params.c_ops)
+    return rates.get("amplitude", 0.0), rates.get("phase", 0.0)
+
+
+def initial_state(params):
+    return qutip.Qobj(np.array(params.initstate),
+                      dims=[[2]*params.num_qubit, [1]*params.num_qubit])
+
+
+def evolution_hamiltonian(params, times, samples=None):
+    """``QobjEvo`` of the full model with the drive sampled on ``times``.
+
+    ``samples`` overrides the drive values, for callers that generate the
+    drive block by block.
+    """
+    if samples is None:
+        samples = drive_samples(params, times)
+    return qutip.QobjEvo(
+        [[drive_operator(params.num_qubit), samples], static_hamiltonian(params)],
+        tlist=times, order=min(interpolation_order(params), len(times) - 1),
+    )
@@ -0,0 +1,189 @@
+"""Background render jobs shared by every session of one server.
+
+Streamlit runs each session's script in its own thread, so rendering
+inline ties a session to a solve and lets N identical requests solve N
+times.  :class:`RenderPool` instead sends renders to worker processes,
+keyed like the caches by :func:`~engine.pipeline.render_key`:
+
+* a request for a render that is already queued or running joins that job
+  instead of starting another;
+* each job remembers the sessions waiting on it, and a session that moves
+  on to other settings releases its jobs; a job nobody waits for is
+  dropped from the queue, or stopped at its next block if already running;
+* workers report progress through a shared dict and spool their PCM to a
+  file, so a waiting page can show how far along the job is and play what
+  has been rendered so far.
+"""
+import itertools
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import CancelledError, ProcessPoolExecutor
+
+from . import metrics
+from .cache import process_cache
+from .params import num_samples
+from .pipeline import render_key, synthesize
+from .stream import wav_header
+
+
+class Cancelled(Exception):
+    """Raised inside a worker when nobody waits for its job any more."""
+
+
+class Job:
+    """A render submitted to a :class:`RenderPool`."""
+
+    def __init__(self, key, future, order, total, channels, spool):
+        self.key = key
+        self.future = future
+        self.order = order
+        self.total = total
+        self.channels = channels
+        self.spool = spool
+        self.owners = set()
+
+    def done(self):
+        return self.future.done()
+
+    def result(self, timeout=None):
+        """The finished :class:`~engine.pipeline.Render`, or None if the job was cancelled."""
+        try:
+            return self.future.result(timeout)
+        except (Cancelled, CancelledError):
+            return None
+
+
+def _preload():
+    """Import the solver stack in a fresh worker, ahead of its first job."""
+    from . import solver
+
+
+def _run(params, method, mix, key, spool, progress, cancelled, profile=None):
+    progress[key] = 0
+    with open(spool, "wb") as f:
+        def on_block(done, total, pcm):
+            if key in cancelled:
+                raise Cancelled(key)
+            f.write(pcm)
+            f.flush()
+            progress[key] = done
+        return synthesize(params, method, mix, on_block, profile)
+
+
+class RenderPool:
+    """Process pool running renders with in-flight deduplication.
+
+    Finished renders go into :data:`~engine.cache.process_cache`, so later
+    requests for them never reach the pool.
+    """
+
+    def __init__(self, workers=None):
+        context = multiprocessing.get_context("spawn")
+        self.executor = ProcessPoolExecutor(workers, mp_context=context)
+        self.manager = context.Manager()
+        self.progress = self.manager.dict()
+        self.cancelled = self.manager.dict()
+        self.spool_dir = tempfile.mkdtemp(prefix="qmusic-jobs-")
+        self.jobs = {}
+        # Reentrant: cancelling a queued job in :meth:`release` runs its
+        # done-callback :meth:`_finish` at once, on the same thread.
+        self.lock = threading.RLock()
+        self.counter = itertools.count()
+        # Workers start with only the engine's light modules; warm one up
+        # while the page is still being set up.
+        self.executor.submit(_preload)
+
+    def submit(self, params, owner, method="auto", mix=None, profile=None):
+        """The job rendering ``params`` for ``owner``, joining an identical one in flight.
+
+        ``profile`` is a path to dump a ``cProfile`` of the render to; it
+        only applies if this call starts a new job.
+        """
+        key = render_key(params, mix)
+        with self.lock:
+            job = self.jobs.get(key)
+            if job is None:
+                spool = os.path.join(self.spool_dir, key + ".pcm")
+                self.cancelled.pop(key, None)
+                future = self.executor.submit(_run, params, method, mix, key, spool,
+                                              self.progress, self.cancelled, profile)
+                job = Job(key, future, next(self.counter), num_samples(params.T),
+                          1 if mix is None else mix.channels, spool)
+                self.jobs[key] = job
+                future.add_done_callback(lambda _, job=job: self._finish(job))
+            else:
+                # Revive a job its last owner gave up on moments ago.
+                self.cancelled.pop(key, None)
+            job.owners.add(owner)
+            return job
+
+    def _finish(self, job):
+        with self.lock:
+            if self.jobs.get(job.key) is job:
+                del self.jobs[job.key]
+        try:
+            hit = job.result()
+            if hit is not None:
+                metrics.observe(hit.stats, key=job.key)
+                process_cache.put(job.key, hit)
+        finally:
+            self.progress.pop(job.key, None)
+            self.cancelled.pop(job.key, None)
+            try:
+                os.remove(job.spool)
+            except FileNotFoundError:
+                pass
+
+    def release(self, owner, keep=None):
+        """Stop waiting on behalf of ``owner`` for every job but the one keyed ``keep``.
+
+        Jobs left without owners are cancelled.
+        """
+        with self.lock:
+            for job in list(self.jobs.values()):
+                if job.key == keep or owner not in job.owners:
+                    continue
+                job.owners.discard(owner)
+                if not job.owners and not job.future.cancel():
+                    self.cancelled[job.key] = True
+
+    def started(self, job):
+        return job.key in self.progress
+
+    def done_samples(self, job):
+        """Samples rendered so far, 0 while the job is queued."""
+        return self.progress.get(job.key, 0)
+
+    def position(self, job):
+        """Number of queued jobs ahead of ``job``, or None once it has started."""
+        if self.started(job):
+            return None
+        with self.lock:
+            return sum(1 for other in self.jobs.values()
+                       if other.order < job.order and not self.started(other))
+
+    def queue_depth(self):
+        """Number of jobs waiting for a worker."""
+        with self.lock:
+            return sum(1 for job in self.jobs.values() if not self.started(job))
+
+    def partial_wav(self, job):
+        """A playable WAV of what ``job`` has rendered so far, or None."""
+        done = self.done_samples(job)
+        if not done:
+            return None
+        try:
+            with open(job.spool, "rb") as f:
+                pcm = f.read(2*job.channels*done)
+        except FileNotFoundError:
+            return None
+        done = len(pcm) // (2*job.channels)
+        return wav_header(done, channels=job.channels) + pcm[:2*job.channels*done]
+
+    def shutdown(self):
+        self.executor.shutdown(cancel_futures=True)
+        self.manager.shutdown()
+        shutil.rmtree(self.spool_dir, ignore_errors=True)
@@ -0,0 +1,170 @@
+"""Lattice geometries and sparse Pauli-string operator assembly.
+
+Site ``i`` of an N-site lattice is the ``i``-th tensor factor, i.e. bit
+``N-1-i`` of the computational basis index, matching ``qutip.tensor``.  A
+Pauli string is stored as an ``(x, z)`` pair of bitmasks (Y sets both), so
+its action on basis state ``b`` is the single entry
+``<b^x| P |b> = i^{popcount(x&z)} (-1)^{popcount(b&z)}`` and whole operators
+can be written straight into CSR without any Kronecker products.
+
+Assembled operators are kept in the on-disk cache of
+:func:`engine.cache.cached_arrays` and memory-mapped back by later
+processes.
+"""
+import functools
+from typing import NamedTuple
+
+import numpy as np
+from scipy import sparse
+
+from .cache import cached_arrays
+
+PAULI_MASKS = {"X": (1, 0), "Y": (1, 1), "Z": (0, 1)}
+
+
+class Lattice(NamedTuple):
+    """Sites on an ``Lx`` x ``Ly`` grid, numbered row by row."""
+    Lx: int
+    Ly: int
+    periodic: bool
+
+    @property
+    def num_sites(self):
+        return self.Lx*self.Ly
+
+    def coords(self, i):
+        return i % self.Lx, i // self.Lx
+
+    @property
+    def bonds(self):
+        """Nearest-neighbour pairs ``(i, j)``.
+
+        With periodic boundaries every site is bonded to its next neighbour
+        modulo the extent of the lattice, so a ring of two sites carries a
+        doubled bond, as in the original 1D model.
+        """
+        pairs = []
+        for i in range(self.num_sites):
+            x, y = self.coords(i)
+            if self.Lx > 1 and (self.periodic or x + 1 < self.Lx):
+                pairs.append((i, y*self.Lx + (x + 1) % self.Lx))
+            if self.Ly > 1 and (self.periodic or y + 1 < self.Ly):
+                pairs.append((i, ((y + 1) % self.Ly)*self.Lx + x))
+        return pairs
+
+
+def pauli_string(num_sites, ops):
+    """``(x, z)`` bitmasks of the Pauli string ``{site: "X" | "Y" | "Z"}``."""
+    x = z = 0
+    for site, op in ops.items():
+        bit = 1 << (num_sites - 1 - site)
+        px, pz = PAULI_MASKS[op]
+        x ^= bit*px
+        z ^= bit*pz
+    return x, z
+
+
+def _popcount_parity(values):
+    """Parity of the popcount of each entry of an integer array."""
+    values = values.copy()
+    shift = 32
+    while shift:
+        values ^= values >> shift
+        shift //= 2
+    return values & 1
+
+
+def _product_phase(x, z):
+    """Phase of X^x Z^z relative to the Pauli string, i^popcount(x&z)."""
+    return 1j**bin(x & z).count("1")
+
+
+def mask_values(num_sites, terms):
+    """Weighted Pauli strings ``[(coef, (x, z)), ...]`` merged by ``x`` mask.
+
+    Strings sharing an ``x`` mask touch the same matrix entries, so they
+    reduce to one column-indexed array ``v`` per mask with
+    ``<b^x| O |b> = v[b]``.
+    """
+    basis = np.arange(2**num_sites, dtype=np.int64)
+    groups = {}
+    for coef, (x, z) in terms:
+        if coef == 0:
+            continue
+        values = coef*_product_phase(x, z)*(1 - 2*_popcount_parity(basis & z))
+        groups[x] = groups.get(x, 0) + values
+    return groups
+
+
+def assemble(num_sites, terms):
+    """Sum of weighted Pauli strings ``[(coef, (x, z)), ...]`` as a CSR matrix."""
+    d = 2**num_sites
+    basis = np.arange(d, dtype=np.int64)
+    groups = mask_values(num_sites, terms)
+    if not groups:
+        return sparse.csr_matrix((d, d), dtype=complex)
+    rows = np.concatenate([basis ^ x for x in groups])
+    cols = np.tile(basis, len(groups))
+    data = np.concatenate([np.broadcast_to(v, d) for v in groups.values()]).astype(complex)
+    H = sparse.csr_matrix((data, (rows, cols)), shape=(d, d))
+    H.eliminate_zeros()
+    return H
+
+
+def csr_arrays(name, matrix):
+    """The arrays of a CSR ``matrix`` for :func:`~engine.cache.cached_arrays`."""
+    matrix.sum_duplicates()
+    return {f"{name}_data": matrix.data, f"{name}_indices": matrix.indices,
+            f"{name}_indptr": matrix.indptr}
+
+
+def csr_from_arrays(arrays, name, d):
+    """The ``d`` x ``d`` CSR matrix stored by :func:`csr_arrays`, sharing its arrays."""
+    matrix = sparse.csr_matrix((arrays[f"{name}_data"], arrays[f"{name}_indices"],
+                                arrays[f"{name}_indptr"]), shape=(d, d), copy=False)
+    matrix.has_canonical_format = True
+    return matrix
+
+
+class Operators(NamedTuple):
+    """Geometry-dependent pieces of the model, assembled once per lattice."""
+    hopping: sparse.csr_matrix   # sum over bonds of XX + YY
+    zz: sparse.csr_matrix        # sum over bonds of ZZ
+    z_sites: np.ndarray          # diagonal of Z_i, shape (N, 2^N)
+
+
+def _operator_arrays(lattice):
+    n = lattice.num_sites
+    hopping, zz = [], []
+    for i, j in lattice.bonds:
+        for op in ("X", "Y"):
+            hopping.append((1, pauli_string(n, {i: op, j: op})))
+        zz.append((1, pauli_string(n, {i: "Z", j: "Z"})))
+    basis = np.arange(2**n, dtype=np.int64)
+    z_sites = np.array([1 - 2*((basis >> (n - 1 - i)) & 1) for i in range(n)], dtype=float)
+    return {**csr_arrays("hopping", assemble(n, hopping)), **csr_arrays("zz", assemble(n, zz)),
+            "z_sites": z_sites}
+
+
+@functools.lru_cache(maxsize=8)
+def operators(lattice):
+    boundary = "periodic" if lattice.periodic else "open"
+    arrays = cached_arrays(f"lattice-{lattice.Lx}x{lattice.Ly}-{boundary}",
+                           lambda: _operator_arrays(lattice))
+    d = 2**lattice.num_sites
+    return Operators(csr_from_arrays(arrays, "hopping", d), csr_from_arrays(arrays, "zz", d),
+                     arrays["z_sites"])
+
+
+@functools.lru_cache(maxsize=8)
+def parity(num_sites):
+    """Diagonal of the global Z parity, +1 for even and -1 for odd popcount."""
+    return 1 - 2*_popcount_parity(np.arange(2**num_sites, dtype=np.int64))
+
+
+def static_hamiltonian(lattice, J, fields):
+    """Heisenberg bonds with ZZ weight ``J`` plus a z-field ``fields[i]`` per site."""
+    ops = operators(lattice)
+    H = ops.hopping + J*ops.zz
+    diag = np.asarray(fields, dtype=float) @ ops.z_sites
+    return (H + sparse.diags(diag, format="csr")).tocsr()
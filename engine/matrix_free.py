@@ -0,0 +1,225 @@
+"""Matrix-free Krylov propagation for large spin counts.
+
+The state is kept as a 2^N vector viewed as an N-index tensor.  Heisenberg
+hopping (XX + YY) swaps the two spins of a bond, so it is applied with two
+strided slice updates per bond; the ZZ couplings and z-gradients are a
+single diagonal, and no operator matrix is ever formed.
+
+As in :mod:`engine.closed_form`, the parity drive commutes with the static
+part, so only ``H0`` is propagated and the drive re-enters as the phase
+``exp(-i Phi(t) P)`` when expectation values are taken.  ``H0`` is time
+independent, which lets one Lanczos basis cover many output samples: the
+observable is projected onto the basis once per step and every sample in
+the step costs only a few small ``m x m`` products.
+"""
+import numpy as np
+from scipy.linalg import eigh_tridiagonal
+
+from . import hamiltonian, lattice, metrics
+from .closed_form import with_drive
+from .params import audio_grid
+
+KRYLOV_DIM = 24
+TOLERANCE = 1e-8
+# Longest run of output samples evaluated from one Lanczos basis.
+MAX_STEP_SAMPLES = 8192
+
+
+def applicable(params):
+    """True if every collapse operator is one this propagator models exactly."""
+    return all(kind in ("amplitude", "phase") for kind, _ in params.c_ops)
+
+
+def cost(params):
+    """Work of a render in units of one amplitude of one Krylov vector."""
+    return 2**params.num_qubit*KRYLOV_DIM
+
+
+def _index(num_qubit, bits):
+    """Basic-indexing tuple fixing ``{site: bit}`` on the N-index tensor view."""
+    return tuple(bits.get(i, slice(None)) for i in range(num_qubit))
+
+
+def static_diagonal(params):
+    """ZZ couplings and z-gradients, the diagonal part of ``H0``."""
+    n = params.num_qubit
+    geo = hamiltonian.geometry(params)
+    basis = np.arange(2**n, dtype=np.int64)
+    z = lambda i: 1 - 2*((basis >> (n - 1 - i)) & 1)
+    diag = np.zeros(2**n)
+    for i, j in geo.bonds:
+        diag += params.J*(z(i)*z(j))
+    for i, b in enumerate(hamiltonian.gradient_field(params)):
+        if b:
+            diag += b*z(i)
+    return diag
+
+
+def apply_static(params, diag, psi, out):
+    """``out = H0 @ psi`` without forming ``H0``."""
+    n = params.num_qubit
+    np.multiply(diag, psi, out=out)
+    src, dst = psi.reshape((2,)*n), out.reshape((2,)*n)
+    for i, j in hamiltonian.geometry(params).bonds:
+        up_down, down_up = _index(n, {i: 0, j: 1}), _index(n, {i: 1, j: 0})
+        dst[up_down] += 2*src[down_up]
+        dst[down_up] += 2*src[up_down]
+    return out
+
+
+def lanczos(apply, v0, m):
+    """Lanczos basis ``V`` (rows) and tridiagonal ``(alpha, beta)`` of ``apply`` on ``v0``.
+
+    Returns the norm of ``v0`` and the residual ``beta_m`` used for the
+    error estimate; a zero residual means the subspace is invariant.
+    """
+    norm = np.linalg.norm(v0)
+    V = np.empty((m, len(v0)), dtype=complex)
+    alpha, beta = np.zeros(m), np.zeros(m)
+    V[0] = v0/norm
+    w = np.empty_like(v0)
+    for k in range(m):
+        apply(V[k], w)
+        alpha[k] = np.vdot(V[k], w).real
+        # Full reorthogonalization keeps the small basis numerically exact.
+        for _ in range(2):
+            w -= (V[:k+1] @ w.conj()).conj() @ V[:k+1]
+        beta[k] = np.linalg.norm(w)
+        if beta[k] < 1e-12*max(1.0, abs(alpha[k])) or k == m - 1:
+            break
+        V[k+1] = w/beta[k]
+    return V[:k+1], alpha[:k+1], beta[:k], beta[k], norm
+
+
+def projections(weights, num_qubit):
+    """Callable ``project(V)`` giving ``V^* L O_j R V`` for every observable.
+
+    ``weights`` come from :func:`engine.hamiltonian.observable_weights`.
+    ``L`` and ``R`` project onto the even and odd sector for an observable
+    that flips parity and are the identity otherwise (see ``finish()`` in
+    :func:`iter_traces`).  Each ``x`` mask costs one gather of the basis
+    and one small matrix product per observable that uses it.
+    """
+    odd = np.flatnonzero(lattice.parity(num_qubit) == -1)
+    count = len(next(iter(weights.values())))
+    masks = []
+    for x, W in weights.items():
+        rows = odd if bin(x).count("1") % 2 else np.arange(2**num_qubit)
+        masks.append((rows, rows ^ x, W[:, rows]))
+
+    def project(V):
+        A = np.zeros((count, len(V), len(V)), dtype=complex)
+        for rows, flipped, W_x in masks:
+            bra, ket = V[:, flipped].conj(), V[:, rows].T
+            for j in np.flatnonzero(W_x.any(axis=1)):
+                A[j] += (bra*W_x[j]) @ ket
+        return A
+    return project
+
+
+def iter_traces(params, observables=None, krylov_dim=KRYLOV_DIM, tol=TOLERANCE, grid=None):
+    """Yield drive-free ``(times, same, cross)`` over consecutive runs of the grid.
+
+    Each run is the span of one Lanczos basis, so only the current state
+    vector and basis are ever held in memory.  The chunks have the meaning
+    of :func:`engine.closed_form.iter_traces`, including ``grid``; every
+    observable is projected onto the same basis, so extra observables do
+    not add propagation.
+    """
+    names = (params.observable,) if observables is None else tuple(observables)
+    grid = grid or audio_grid(params.T)
+    total = grid.size
+    n = params.num_qubit
+    with metrics.stage("operators"):
+        diag = static_diagonal(params)
+        even, odd = lattice.parity(n) == 1, lattice.parity(n) == -1
+        flips = np.array([hamiltonian.observable_flips(n, name) for name in names])
+        weights = hamiltonian.observable_weights(n, names)
+        project = projections(weights, n)
+    gamma_amp, gamma = hamiltonian.damping_rates(params)
+    apply_H = lambda psi, out: apply_static(params, diag, psi, out)
+
+    psi = np.array(params.initstate, dtype=complex)
+    top = len(psi) - 1
+    a_top = psi[top] if gamma_amp else 0
+    if a_top:
+        psi[top] = 0
+        # Column |1...1> of each observable, cut down by the projectors.
+        column = np.zeros((len(names), len(psi)), dtype=complex)
+        for x, W in weights.items():
+            column[:, top ^ x] += W[:, top]
+        left = np.where(flips[:, None], even, True)
+        right = np.where(flips[:, None], odd, True)
+        x = column*left*right[:, top:]
+        y = column*right*left[:, top:]
+    if gamma_amp:
+        # Population moved to |0...0> by a jump, also an eigenstate of H(t).
+        g_O_g = weights[0][:, 0].real if 0 in weights else np.zeros(len(names))
+
+    def isolated(times):
+        return a_top*np.exp(-(1j*diag[top] + gamma_amp/2)*times)
+
+    def finish(times, G):
+        same = np.where(flips[:, None], 0, G.real)
+        if gamma_amp:
+            same += np.outer(g_O_g, abs(params.initstate[top])**2*(1 - np.exp(-gamma_amp*times)))
+        cross = np.where(flips[:, None], 2*G, 0)
+        if gamma:
+            cross *= np.exp(-2*gamma*times)
+        if observables is None:
+            return times, same[0], cross[0] if flips[0] else None
+        return times, same, cross
+
+    if not psi.any():
+        for start in range(0, total, MAX_STEP_SAMPLES):
+            times = grid.times(start, start+MAX_STEP_SAMPLES)
+            G = np.zeros((len(names), len(times)), dtype=complex)
+            if a_top:
+                G += np.outer(x[:, top], abs(isolated(times))**2)
+            yield finish(times, G)
+        return
+
+    start = 0
+    while True:
+        with metrics.stage("traces"):
+            V, alpha, beta, residual, norm = lanczos(apply_H, psi, min(krylov_dim, len(psi)))
+            m = len(alpha)
+            if m > 1:
+                E, U = eigh_tridiagonal(alpha, beta)
+            else:
+                E, U = alpha, np.ones((1, 1))
+
+            A = project(V)
+
+            times = grid.times(start, start+MAX_STEP_SAMPLES)
+            phases = np.exp(-1j*np.outer(times - times[0], E))*U[0]
+            error = norm*residual*np.abs(phases @ U[-1])
+            bad = np.flatnonzero(error > tol)
+            stop = len(times) if len(bad) == 0 else max(bad[0], 2)
+            coefs = norm*(phases[:stop] @ U.T)
+            bra_A = (coefs.conj() @ A.transpose(1, 0, 2).reshape(m, -1)).reshape(stop, -1, m)
+            G = np.einsum('tjl,tl->jt', bra_A, coefs)
+            if a_top:
+                alpha_t = isolated(times[:stop])
+                u = (V @ x.conj().T).conj()
+                v = V @ y.conj().T
+                G += alpha_t*(coefs.conj() @ u).T + alpha_t.conj()*(coefs @ v).T
+                G += np.outer(x[:, top], abs(alpha_t)**2)
+
+        # The last sample of the run starts the next one.
+        last = start + stop == total
+        keep = stop if last else stop - 1
+        yield finish(times[:keep], G[:, :keep])
+        if last:
+            return
+        psi = coefs[-1] @ V
+        start += stop - 1
+
+
+def iter_solve(params, observables=None, **kwargs):
+    """Yield the expectation value over consecutive runs of the time grid."""
+    return with_drive(iter_traces(params, observables, **kwargs), params)
+
+
+def solve(params, observables=None, **kwargs):
+    return np.concatenate(list(iter_solve(params, observables, **kwargs)), axis=-1)
@@ -0,0 +1,173 @@
+"""Per-stage timers and memory counters for renders.
+
+Hot steps of the engine run inside ``with stage("name"):``.  While a
+render is being recorded (see :func:`recording`) every stage adds its wall
+time, its call count and how far it raised the process's peak resident
+memory; otherwise a stage costs one context variable lookup.  Stages nest
+and their times are inclusive: ``solve`` contains ``operators``,
+``traces``, ``resample``, ``drive``, ``qobjevo`` and ``mesolve``.  Facts
+about how a render was solved, such as the coarse grid and error bound of
+:mod:`engine.resample`, are attached with :func:`note`.
+
+A finished render carries its summary as ``Render.stats``.  :func:`observe`
+adds a summary to the totals of this process, logs it as one JSON line on
+the ``engine.metrics`` logger and, if ``$QMUSIC_METRICS_TEXTFILE`` names a
+file, rewrites it in the Prometheus text format for node_exporter's
+textfile collector.
+"""
+import contextlib
+import contextvars
+import cProfile
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+TEXTFILE_ENV = "QMUSIC_METRICS_TEXTFILE"
+
+_current = contextvars.ContextVar("recorder", default=None)
+
+
+def peak_rss():
+    """High-water mark of this process's resident memory in bytes, 0 if unknown."""
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak*1024
+
+
+class Recorder:
+    """Stage timings of one render."""
+
+    def __init__(self):
+        self.stages = {}
+        self.start = time.perf_counter()
+        self.rss = peak_rss()
+        self.profile = None
+        self.notes = {}
+
+    def add(self, name, seconds, grown):
+        entry = self.stages.setdefault(name, {"seconds": 0.0, "calls": 0, "rss_growth_bytes": 0})
+        entry["seconds"] += seconds
+        entry["calls"] += 1
+        entry["rss_growth_bytes"] += grown
+
+    def summary(self):
+        return {
+            "seconds": time.perf_counter() - self.start,
+            "peak_rss_bytes": peak_rss(),
+            "rss_growth_bytes": peak_rss() - self.rss,
+            "stages": {name: dict(entry) for name, entry in self.stages.items()},
+            "notes": dict(self.notes),
+            "profile": self.profile,
+        }
+
+
+def note(name, value):
+    """Attach ``value`` as ``name`` to the summary of the render being recorded, if any."""
+    recorder = _current.get()
+    if recorder is not None:
+        recorder.notes[name] = value
+
+
+@contextlib.contextmanager
+def stage(name):
+    """Time the body as stage ``name`` of the render being recorded, if any."""
+    recorder = _current.get()
+    if recorder is None:
+        yield
+        return
+    rss, start = peak_rss(), time.perf_counter()
+    try:
+        yield
+    finally:
+        recorder.add(name, time.perf_counter() - start, peak_rss() - rss)
+
+
+@contextlib.contextmanager
+def recording(profile=None):
+    """Record the stages run in the body; yields the :class:`Recorder`.
+
+    With ``profile`` a path, the body also runs under ``cProfile`` and the
+    statistics are dumped there for ``pstats`` or snakeviz.  Only the
+    calling thread is profiled, not the workers of a process pool.
+    """
+    recorder = Recorder()
+    token = _current.set(recorder)
+    profiler = cProfile.Profile() if profile else None
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield recorder
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(profile)
+            recorder.profile = profile
+        _current.reset(token)
+
+
+_lock = threading.Lock()
+_totals = {"renders": 0, "seconds": 0.0, "peak_rss_bytes": 0, "stages": {}}
+
+
+def observe(stats, **labels):
+    """Add the ``stats`` of a finished render to the totals of this process."""
+    if not stats:
+        return
+    with _lock:
+        _totals["renders"] += 1
+        _totals["seconds"] += stats["seconds"]
+        _totals["peak_rss_bytes"] = max(_totals["peak_rss_bytes"], stats["peak_rss_bytes"])
+        for name, entry in stats["stages"].items():
+            total = _totals["stages"].setdefault(name, {"seconds": 0.0, "calls": 0})
+            total["seconds"] += entry["seconds"]
+            total["calls"] += entry["calls"]
+    logger.info(json.dumps({"event": "render", **labels, **stats}))
+    path = os.environ.get(TEXTFILE_ENV)
+    if path:
+        write_textfile(path)
+
+
+def exposition():
+    """The totals in the Prometheus text exposition format."""
+    with _lock:
+        totals = json.loads(json.dumps(_totals))
+    lines = [
+        "# HELP qmusic_renders_total Renders solved by this process.",
+        "# TYPE qmusic_renders_total counter",
+        f"qmusic_renders_total {totals['renders']}",
+        "# HELP qmusic_render_seconds_total Wall time spent rendering.",
+        "# TYPE qmusic_render_seconds_total counter",
+        f"qmusic_render_seconds_total {totals['seconds']}",
+        "# HELP qmusic_render_peak_rss_bytes Largest peak resident memory of a render.",
+        "# TYPE qmusic_render_peak_rss_bytes gauge",
+        f"qmusic_render_peak_rss_bytes {totals['peak_rss_bytes']}",
+        "# HELP qmusic_stage_seconds_total Wall time per render stage, inclusive of nested stages.",
+        "# TYPE qmusic_stage_seconds_total counter",
+    ]
+    stages = sorted(totals["stages"].items())
+    lines += [f'qmusic_stage_seconds_total{{stage="{name}"}} {entry["seconds"]}' for name, entry in stages]
+    lines += [
+        "# HELP qmusic_stage_calls_total Times each render stage ran.",
+        "# TYPE qmusic_stage_calls_total counter",
+    ]
+    lines += [f'qmusic_stage_calls_total{{stage="{name}"}} {entry["calls"]}' for name, entry in stages]
+    return "\n".join(lines) + "\n"
+
+
+def write_textfile(path):
+    """Atomically replace ``path`` with :func:`exposition`."""
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        f.write(exposition())
+    os.replace(tmp, path)
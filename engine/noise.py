@@ -0,0 +1,70 @@
+"""Seeded noise on the drive field, generated block by block.
+
+Every model filters the white Gaussian stream of ``params.noise_seed``
+through a linear recurrence, run over whole blocks with
+:func:`scipy.signal.lfilter` and carrying its state to the next block, so
+any split of the time grid draws the same noise:
+
+``white``
+    independent samples of standard deviation ``noise_std``;
+``pink``
+    1/f noise from a three-pole filter fitted to the 1/f slope over the
+    audio band, scaled to a stationary standard deviation ``noise_std``;
+``brown``
+    a random walk from 0 whose spread after one second is ``noise_std``;
+``ou``
+    the exact discrete update of an Ornstein-Uhlenbeck process with
+    correlation time ``noise_tau`` and stationary deviation ``noise_std``.
+
+Pink noise starts from rest.  The walk and the Ornstein-Uhlenbeck process
+need the grid to be uniform and read its step off the first two samples.
+"""
+import numpy as np
+from scipy import signal
+
+# J. O. Smith's three-pole, three-zero approximation of a 1/f spectrum.
+PINK_B = np.array([0.049922035, -0.095993537, 0.050612699, -0.004408786])
+PINK_A = np.array([1, -2.494956002, 2.017265875, -0.522189400])
+# Stationary standard deviation of the filter driven by unit white noise.
+PINK_GAIN = np.sqrt(np.sum(signal.lfilter(PINK_B, PINK_A, signal.unit_impulse(2**16))**2))
+
+
+class Noise:
+    """The noise of ``params`` over consecutive slices of a uniform time grid."""
+
+    def __init__(self, params):
+        self.params = params
+        self._rng = np.random.default_rng(params.noise_seed)
+        self._state = np.zeros(len(PINK_A) - 1)
+        self._coefs = None
+        self._last = None
+
+    def _recurrence(self, step):
+        """``(b, a)`` of the random walk or Ornstein-Uhlenbeck update over ``step``."""
+        if self.params.noise_color == "brown":
+            return [np.sqrt(step)], [1, -1]
+        decay = np.exp(-step/self.params.noise_tau)
+        return [np.sqrt(1 - decay**2)], [1, -decay]
+
+    def block(self, times):
+        p = self.params
+        white = self._rng.normal(0, p.noise_std, len(times))
+        if p.noise_color == "white" or not len(times):
+            return white
+        if p.noise_color == "pink":
+            noise, self._state = signal.lfilter(PINK_B/PINK_GAIN, PINK_A, white, zi=self._state)
+            return noise
+        noise = np.empty(len(times))
+        start = 0
+        if self._last is None:
+            # The walk starts at 0, the Ornstein-Uhlenbeck process stationary.
+            noise[0] = 0.0 if p.noise_color == "brown" else white[0]
+            self._last = times[0], noise[0]
+            start = 1
+        if start < len(times):
+            if self._coefs is None:
+                self._coefs = self._recurrence(times[start] - self._last[0])
+            b, a = self._coefs
+            noise[start:], _ = signal.lfilter(b, a, white[start:], zi=[-a[1]*self._last[1]])
+            self._last = times[-1], noise[-1]
+        return noise
@@ -0,0 +1,168 @@
+import hashlib
+from typing import NamedTuple
+
+import numpy as np
+
+from .states import normalize
+
+SAMPLE_RATE = 44100
+
+DIMS = ("1D", "2D")
+WAVEFORMS = ("sine", "square", "sawtooth")
+OBSERVABLES = ("prod", "sum")
+NOISE_COLORS = ("white", "pink", "brown", "ou")
+DECOHERENCE = {
+    "amplitude": ("amplitude",),
+    "phase": ("phase",),
+    "both": ("amplitude", "phase"),
+}
+
+
+class SimParams(NamedTuple):
+    """Canonical description of one Larmor precession render.
+
+    Build instances with :func:`make_params` so that knobs which do not
+    affect the result (e.g. ``duty`` for a sine drive) are normalized and
+    equivalent settings share one cache entry.
+    """
+    dim: str
+    num_qubit: int
+    size: tuple
+    periodic: bool
+    B0: float
+    grad: float
+    gradx: float
+    grady: float
+    amp: float
+    waveform: str
+    duty: float
+    w: float
+    f: float
+    J: float
+    noise_std: float
+    noise_seed: int | None
+    noise_color: str
+    noise_tau: float
+    c_ops: tuple
+    observable: str
+    T: int
+    initstate: tuple
+
+    def key(self):
+        """Stable hash of the parameters, shared by every cache layer."""
+        h = hashlib.sha1(repr(self[:-1]).encode())
+        h.update(np.asarray(self.initstate, dtype=complex).tobytes())
+        return h.hexdigest()
+
+
+def default_initstate(num_qubit):
+    return np.ones(2**num_qubit) / np.sqrt(2**num_qubit)
+
+
+def make_params(dim, num_qubit, B0, amp, f, J, T, grad=0, gradx=0, grady=0,
+                waveform="sine", duty=0.5, w=1.0, noise_std=0, noise_seed=None,
+                noise_color="white", noise_tau=0, decoherence=None, gamma=0,
+                observable="prod", initstate=None, size=None, periodic=None):
+    """Validate and normalize one render's settings into a :class:`SimParams`.
+
+    A 1D chain of ``num_qubit`` spins is periodic unless ``periodic=False``.
+    A 2D lattice is ``size=(Lx, Ly)`` (square by default) with open
+    boundaries unless ``periodic=True``.  ``noise_color`` is one of the
+    models of :mod:`engine.noise`; ``noise_tau`` is the correlation time of
+    ``"ou"`` noise.
+    """
+    if dim not in DIMS:
+        raise ValueError(f"dim must be one of {DIMS}, got {dim!r}")
+    if waveform not in WAVEFORMS:
+        raise ValueError(f"waveform must be one of {WAVEFORMS}, got {waveform!r}")
+    if observable not in OBSERVABLES:
+        raise ValueError(f"observable must be one of {OBSERVABLES}, got {observable!r}")
+    if dim == "1D":
+        gradx = grady = 0
+        size = (num_qubit, 1)
+        periodic = True if periodic is None else periodic
+    else:
+        if size is None:
+            side = int(np.sqrt(num_qubit))
+            if side**2 != num_qubit:
+                raise ValueError("a 2D square lattice needs a square number of qubits")
+            size = (side, side)
+        if size[0]*size[1] != num_qubit:
+            raise ValueError(f"a {size[0]}x{size[1]} lattice has {size[0]*size[1]} sites, not {num_qubit}")
+        grad = 0
+        periodic = False if periodic is None else periodic
+    if num_qubit == 1:
+        # A single spin has no bonds to couple.
+        J = 0
+    if waveform != "square":
+        duty = 0.5
+    if waveform != "sawtooth":
+        w = 1.0
+    if noise_color not in NOISE_COLORS:
+        raise ValueError(f"noise_color must be one of {NOISE_COLORS}, got {noise_color!r}")
+    if not noise_std:
+        noise_std, noise_seed, noise_color = 0, None, "white"
+    elif noise_seed is None:
+        raise ValueError("noisy renders need an explicit noise_seed")
+    if noise_color != "ou":
+        noise_tau = 0
+    elif noise_tau <= 0:
+        raise ValueError("Ornstein-Uhlenbeck noise needs a positive noise_tau")
+    c_ops = ()
+    if decoherence is not None:
+        if decoherence not in DECOHERENCE:
+            raise ValueError(f"decoherence must be one of {tuple(DECOHERENCE)}, got {decoherence!r}")
+        c_ops = tuple((kind, float(gamma)) for kind in DECOHERENCE[decoherence])
+
+    if initstate is None:
+        initstate = default_initstate(num_qubit)
+    initstate = normalize(initstate, num_qubit)
+
+    return SimParams(
+        dim=dim, num_qubit=int(num_qubit),
+        size=(int(size[0]), int(size[1])), periodic=bool(periodic),
+        B0=float(B0), grad=float(grad),
+        gradx=float(gradx), grady=float(grady), amp=float(amp),
+        waveform=waveform, duty=float(duty), w=float(w), f=float(f),
+        J=float(J), noise_std=float(noise_std),
+        noise_seed=None if noise_seed is None else int(noise_seed),
+        noise_color=noise_color, noise_tau=float(noise_tau),
+        c_ops=c_ops, observable=observable, T=int(T),
+        initstate=tuple(initstate.tolist()),
+    )
+
+
+def num_samples(T, samplerate=SAMPLE_RATE):
+    return samplerate*T
+
+
+class Grid(NamedTuple):
+    """``size`` uniform sample times ``k*step`` from t = 0.
+
+    ``end``, if given, replaces the last time exactly, as ``linspace`` does.
+    """
+    step: float
+    size: int
+    end: float | None = None
+
+    def times(self, start=0, stop=None):
+        stop = self.size if stop is None else min(stop, self.size)
+        times = np.arange(start, stop)*self.step
+        if self.end is not None and stop == self.size and stop > start:
+            times[-1] = self.end
+        return times
+
+
+def audio_grid(T, samplerate=SAMPLE_RATE):
+    """The grid of ``np.linspace(0, T, samplerate*T)``."""
+    n = num_samples(T, samplerate)
+    return Grid(T/(n - 1), n, T)
+
+
+def time_grid(T, start=0, stop=None):
+    """Samples ``start:stop`` of ``np.linspace(0, T, SAMPLE_RATE*T)``.
+
+    Computed the same way as ``linspace`` so that slices agree bit for bit
+    with the full grid, without materializing it.
+    """
+    return audio_grid(T).times(start, stop)
@@ -0,0 +1,188 @@
+"""Parareal: time-parallel ``mesolve`` for long renders.
+
+The time axis is cut into segments of :data:`SEGMENT_SECONDS`.  A cheap
+coarse propagator (``mesolve`` with loose tolerances on a subsampled drive)
+sweeps through them to guess the state at every segment start; the fine
+propagator (``mesolve`` on the audio grid) then refines all segments at
+once on a process pool, and the correction
+
+    U[n+1] <- G(U[n]) + F(U_old[n]) - G(U_old[n])
+
+is repeated until no segment start moves by more than ``tol``.  After
+iteration k the first k segments are exact, so their audio is yielded as
+soon as it is final.
+
+Segment start states are checkpointed per physical setup (the parameters
+without ``T``) when a ``checkpoints`` directory is given.  Starting again,
+after an interruption or with a longer ``T``, takes the stored states as
+the initial guess, so segments already solved converge on the first fine
+pass and only the new part of a render needs iterating.
+
+The closed-form and matrix-free backends know the state at any time
+exactly and never need this, so ``method="auto"`` never picks it; it is
+run when ``method="parareal"`` is asked for.
+"""
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import qutip
+
+from . import hamiltonian, metrics
+from .params import num_samples, time_grid
+from .waveform import Drive
+
+SEGMENT_SECONDS = 1.0
+TOLERANCE = 1e-6
+MAX_ITERATIONS = 8
+# Drive samples per segment seen by the coarse propagator.
+COARSE_SAMPLES = 64
+COARSE_OPTIONS = {"atol": 1e-5, "rtol": 1e-3}
+
+
+def _evolve(params, state, times, samples, e_ops=None, options=None):
+    with metrics.stage("qobjevo"):
+        H = hamiltonian.evolution_hamiltonian(params, times, samples)
+    with metrics.stage("mesolve"):
+        return qutip.mesolve(H, state, times, c_ops=hamiltonian.collapse_operators(params),
+                             e_ops=e_ops, options={**(options or {}), "store_final_state": True})
+
+
+def coarse(params, state, times, samples):
+    """Cheap estimate of the state at ``times[-1]`` starting from ``times[0]``."""
+    stride = max(1, (len(times) - 1) // COARSE_SAMPLES)
+    index = np.unique(np.append(np.arange(0, len(times), stride), len(times) - 1))
+    result = _evolve(params, state, times[index], samples[index], options=COARSE_OPTIONS)
+    return result.final_state
+
+
+def fine(params, state, times, samples, observables):
+    """Expectation values on ``times`` and the state at ``times[-1]``."""
+    e_ops = [hamiltonian.observable(params._replace(observable=name)) for name in observables]
+    result = _evolve(params, state, times, samples, e_ops=e_ops)
+    return np.real(np.array(result.expect)), result.final_state
+
+
+def segment_bounds(params):
+    """Sample index where each segment starts, plus the last sample."""
+    total = num_samples(params.T)
+    step = SEGMENT_SECONDS*(total - 1)/params.T
+    count = max(1, int(np.ceil((total - 1)/step)))
+    return [min(round(k*step), total - 1) for k in range(count + 1)]
+
+
+def _distance(a, b):
+    return np.linalg.norm(a.full() - b.full())
+
+
+def _state_shape(params):
+    """States are density matrices with collapse operators, kets otherwise."""
+    d = 2**params.num_qubit
+    return (d, d) if params.c_ops else (d, 1)
+
+
+def _checkpoint_path(checkpoints, params):
+    return os.path.join(checkpoints, params._replace(T=0).key() + ".npz")
+
+
+def load_checkpoint(checkpoints, params, starts):
+    """Stored states at the segment start times ``starts``, None where missing."""
+    guesses = [None]*len(starts)
+    path = _checkpoint_path(checkpoints, params)
+    if not os.path.exists(path):
+        return guesses
+    stored = np.load(path)
+    if stored["states"].shape[1:] != _state_shape(params):
+        return guesses
+    tol = 0.5*params.T/(num_samples(params.T) - 1)
+    dims = [[2]*params.num_qubit]*2 if params.c_ops else [[2]*params.num_qubit, [1]*params.num_qubit]
+    for n, t in enumerate(starts):
+        match = np.flatnonzero(np.abs(stored["times"] - t) <= tol)
+        if len(match):
+            guesses[n] = qutip.Qobj(stored["states"][match[0]], dims=dims)
+    return guesses
+
+
+def save_checkpoint(checkpoints, params, starts, states):
+    """Merge the segment start states into the checkpoint of this setup."""
+    os.makedirs(checkpoints, exist_ok=True)
+    path = _checkpoint_path(checkpoints, params)
+    times = np.asarray(starts, dtype=float)
+    # The initial ket is stored as a density matrix like the other states.
+    arrays = np.array([qutip.ket2dm(state).full() if state.shape != _state_shape(params)
+                       else state.full() for state in states])
+    if os.path.exists(path):
+        stored = np.load(path)
+        if stored["states"].shape[1:] == arrays.shape[1:]:
+            tol = 0.5*params.T/(num_samples(params.T) - 1)
+            old = [i for i, t in enumerate(stored["times"]) if np.all(np.abs(times - t) > tol)]
+            times = np.concatenate([stored["times"][old], times])
+            arrays = np.concatenate([stored["states"][old], arrays])
+    order = np.argsort(times)
+    tmp = path + ".tmp.npz"
+    np.savez(tmp, times=times[order], states=arrays[order])
+    os.replace(tmp, path)
+
+
+def iter_solve(params, observables=None, tol=TOLERANCE, max_iterations=MAX_ITERATIONS,
+               workers=None, executor=None, checkpoints=None):
+    """Yield expectation values segment by segment, each once it is final.
+
+    Segments still moving by more than ``tol`` after ``max_iterations`` are
+    finished by propagating the fine solution sequentially.
+    """
+    names = (params.observable,) if observables is None else tuple(observables)
+    times = time_grid(params.T)
+    samples = Drive(params).block(times)[0]
+    bounds = segment_bounds(params)
+    count = len(bounds) - 1
+    piece = lambda n: slice(bounds[n], bounds[n+1] + 1)
+    starts = [times[b] for b in bounds[:-1]]
+
+    U = [hamiltonian.initial_state(params)] + [None]*count
+    if checkpoints is not None:
+        U[1:count] = load_checkpoint(checkpoints, params, starts)[1:]
+    G = [None]*count
+    for n in range(count):
+        G[n] = coarse(params, U[n], times[piece(n)], samples[piece(n)])
+        if U[n+1] is None:
+            U[n+1] = G[n]
+
+    def emit(values, n):
+        values = values if n == count - 1 else values[:, :-1]
+        return values if observables is not None else values[0]
+
+    own = executor is None
+    if own:
+        executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"))
+    try:
+        exact = 0
+        for _ in range(max_iterations):
+            futures = {n: executor.submit(fine, params, U[n], times[piece(n)], samples[piece(n)], names)
+                       for n in range(exact, count)}
+            results = {n: future.result() for n, future in futures.items()}
+            new = U[:exact+1]
+            for n in range(exact, count):
+                estimate = coarse(params, new[n], times[piece(n)], samples[piece(n)])
+                new.append(estimate + results[n][1] - G[n])
+                G[n] = estimate
+            moved = [_distance(new[n+1], U[n+1]) for n in range(count)]
+            U = new
+            if checkpoints is not None:
+                save_checkpoint(checkpoints, params, starts, U[:count])
+            # Segment n is final once every start up to its own has settled.
+            settled = next((n for n in range(exact + 1, count) if moved[n - 1] > tol), count)
+            for n in range(exact, settled):
+                yield emit(results[n][0], n)
+            exact = settled
+            if exact == count:
+                return
+    finally:
+        if own:
+            executor.shutdown(cancel_futures=True)
+
+    state = U[exact]
+    for n in range(exact, count):
+        values, state = fine(params, state, times[piece(n)], samples[piece(n)], names)
+        yield emit(values, n)
@@ -0,0 +1,124 @@
+import numpy as np
+
+from . import metrics
+from .audio import encode
+from .cache import process_cache
+from .params import SAMPLE_RATE, num_samples
+from .stream import pcm_blocks
+
+
+class Render:
+    """The signal of a render; audio files are encoded from it on request.
+
+    ``signal`` is the expectation value, or for a mix the channels it was
+    mixed down to, one column each.  Each format is encoded once and kept
+    with the result, so a render that is played but never downloaded never
+    holds a second copy.  ``stats`` is the :mod:`engine.metrics` summary of
+    a fresh render.
+    """
+
+    def __init__(self, signal, stats=None, samplerate=SAMPLE_RATE):
+        self.signal = signal
+        self.stats = stats
+        self.samplerate = samplerate
+        self._encoded = {}
+
+    @property
+    def channels(self):
+        return 1 if self.signal.ndim == 1 else self.signal.shape[1]
+
+    def encode(self, fmt="wav"):
+        """The render as a file of ``fmt``, see :data:`engine.audio.FORMATS`."""
+        data = self._encoded.get(fmt)
+        if data is None:
+            data = self._encoded[fmt] = encode(self.signal, fmt, self.samplerate)
+        return data
+
+    @property
+    def nbytes(self):
+        """Memory held: the signal plus every format encoded so far."""
+        return self.signal.nbytes + sum(len(data) for data in list(self._encoded.values()))
+
+    @property
+    def wav(self):
+        return self.encode("wav")
+
+
+def render_key(params, mix=None):
+    """Cache key of a render: the parameters, plus the mix if there is one."""
+    return params.key() if mix is None else params.key() + mix.key()
+
+
+def lookup(params, session_cache=None, bank=None, mix=None):
+    """A cached or pre-rendered :class:`Render` of ``params``, or None.
+
+    Hits from the process-wide cache or the bank are copied into
+    ``session_cache``.
+    """
+    key = render_key(params, mix)
+    if session_cache is not None:
+        hit = session_cache.get(key)
+        if hit is not None:
+            return hit
+    hit = process_cache.get(key)
+    if hit is None and bank is not None and mix is None:
+        hit = bank.render(params)
+    if hit is not None and session_cache is not None:
+        session_cache.put(key, hit)
+    return hit
+
+
+def remember(params, hit, session_cache=None, mix=None):
+    """Store a fresh :class:`Render` in the process-wide and session caches."""
+    key = render_key(params, mix)
+    process_cache.put(key, hit)
+    if session_cache is not None:
+        session_cache.put(key, hit)
+
+
+def synthesize(params, method="auto", mix=None, on_block=None, profile=None):
+    """Solve ``params`` block by block, without any caching.
+
+    The signal is normalized with a running peak; ``on_block(done, total,
+    pcm)`` is called after each block with the number of samples so far
+    and the PCM bytes of that block only, which a caller can append to a
+    file (prefix it with :func:`~engine.stream.wav_header` to play).  The stages are recorded
+    in ``Render.stats``, and with ``profile`` a path the render is also
+    profiled into it, see :func:`engine.metrics.recording`.  The audio
+    file is only encoded when asked for, see :meth:`Render.encode`.
+    """
+    total = num_samples(params.T)
+    blocks, done = [], 0
+    with metrics.recording(profile) as recorder:
+        for block, chunk in pcm_blocks(params, method, mix=mix):
+            blocks.append(block)
+            done += len(block)
+            if on_block is not None:
+                on_block(done, total, chunk.astype('<i2').tobytes())
+        signal = np.concatenate(blocks)
+        signal.setflags(write=False)
+    return Render(signal, recorder.summary())
+
+
+def render(params, session_cache=None, method="auto", on_block=None, bank=None, mix=None):
+    """Solve and encode ``params``, memoized per session and per process.
+
+    ``session_cache`` is any :class:`~engine.cache.LRUCache` owned by the
+    caller (the Streamlit page keeps one in ``st.session_state``); the
+    process-wide cache backs it so settings seen by another session are
+    reused as well.  All solver methods agree to within solver tolerance,
+    so ``method`` is not part of the cache key.  A
+    :class:`~engine.bank.SoundBank` passed as ``bank`` is consulted before
+    the solver.  On a miss ``on_block`` reports progress as in
+    :func:`synthesize`.
+
+    With a :class:`~engine.audio.Mix` every observable of the mix is solved
+    in the same pass and mixed down as it comes in; the signal and the
+    audio have one channel per column of its gains.
+    """
+    hit = lookup(params, session_cache, bank, mix)
+    if hit is None:
+        hit = synthesize(params, method, mix, on_block)
+        metrics.observe(hit.stats, key=render_key(params, mix), method=method)
+        remember(params, hit, session_cache, mix)
+    return hit
@@ -0,0 +1,70 @@
+"""Instant low-fidelity previews to play while the full render runs.
+
+A preview is the first :data:`PREVIEW_SECONDS` of a render at
+:data:`PREVIEW_RATE`, on the time axis of the full render, rebuilt from a
+coarse solve by :mod:`engine.resample` with a looser tolerance.  It always
+uses a backend that separates the drive (closed form, symmetry sectors or
+matrix-free); collapse operators none of them model are dropped, so such
+settings are previewed as a closed system.
+
+The drive-free traces are kept per static setup (see
+:func:`engine.sweep.static_key`), so moving a drive slider (B0, amplitude,
+frequency, waveform, noise) only reapplies the drive phase to cached
+traces.
+"""
+import numpy as np
+
+from . import closed_form, matrix_free, metrics, resample, solver, symmetry
+from .cache import LRUCache
+from .closed_form import with_drive
+from .params import num_samples
+from .pipeline import Render
+from .sweep import static_key
+
+PREVIEW_SECONDS = 0.5
+PREVIEW_RATE = 11025
+# Far below what a 0.5 s preview at a quarter of the audio rate can resolve.
+PREVIEW_TOLERANCE = 1e-4
+
+BACKENDS = {"closed_form": closed_form, "symmetry": symmetry, "matrix_free": matrix_free}
+
+_traces = LRUCache(16)
+
+
+def preview_params(params):
+    """``params`` as previewed: without collapse operators no drive-separating backend models."""
+    if solver.select_method(params) in BACKENDS:
+        return params
+    return params._replace(c_ops=())
+
+
+def traces(params, observables=None, seconds=PREVIEW_SECONDS, samplerate=PREVIEW_RATE):
+    """The ``(times, same, cross)`` chunks of a preview, cached per static setup."""
+    params = preview_params(params)
+    observables = None if observables is None else tuple(observables)
+    key = (static_key(params), observables, seconds, samplerate)
+    chunks = _traces.get(key)
+    if chunks is None:
+        backend = BACKENDS[solver.select_method(params)]
+        size = min(int(seconds*samplerate), num_samples(params.T, samplerate))
+        chunks = list(resample.iter_traces(params, observables, samplerate, PREVIEW_TOLERANCE,
+                                           backend.iter_traces, size))
+        _traces.put(key, chunks)
+    return chunks
+
+
+def render_preview(params, mix=None, seconds=PREVIEW_SECONDS, samplerate=PREVIEW_RATE):
+    """A :class:`~engine.pipeline.Render` of the start of ``params``, for instant playback.
+
+    With a :class:`~engine.audio.Mix` every observable of the mix is
+    solved and the audio is mixed as in the full render.
+    """
+    observables = None if mix is None else mix.observables
+    with metrics.recording() as recorder:
+        chunks = traces(params, observables, seconds, samplerate)
+        signal = np.concatenate(list(with_drive(chunks, params)), axis=-1)
+        if mix is not None:
+            signal = signal.T @ mix.matrix()
+    signal = signal.astype(np.float32)
+    signal.setflags(write=False)
+    return Render(signal, recorder.summary(), samplerate)
@@ -0,0 +1,158 @@
+"""Drive-free traces on a coarse time grid, resampled to the output rate.
+
+In ``<O>(t) = same(t) + Re(exp(2i Phi(t)) cross(t))`` (see
+:func:`engine.closed_form.iter_traces`) the precession in the field ``B0``
+lives entirely in the drive phase, which is known in closed form at every
+output sample.  ``same`` and ``cross`` only oscillate at Bohr frequencies
+of the static Hamiltonian, usually far below the audio band, so they are
+evaluated on a grid ``stride`` times coarser than the output, rebuilt with
+a polyphase low-pass filter (:func:`scipy.signal.resample_poly`), and only
+then combined with the drive on the output grid.
+
+:func:`plan` bounds the Bohr frequencies from the coefficients of the
+Hamiltonian, picks the coarsest grid that keeps them well below its
+Nyquist frequency, and designs a Kaiser filter whose passband ripple and
+stopband leakage keep the reconstruction error under ``tol``.  The first
+few output samples, where the filter would reach before t = 0, are
+evaluated directly on the output grid.
+"""
+from typing import NamedTuple
+
+import numpy as np
+from scipy import signal
+
+from . import closed_form, hamiltonian, matrix_free, metrics
+from .closed_form import with_drive
+from .params import SAMPLE_RATE, Grid, audio_grid
+
+# Absolute error allowed on the expectation values, as in matrix_free.
+TOLERANCE = 1e-8
+# Coarse sample rate relative to twice the highest Bohr frequency.
+OVERSAMPLE = 1.5
+MAX_STRIDE = 64
+# Output samples resampled per chunk.
+CHUNK_SAMPLES = 16384
+
+
+class Plan(NamedTuple):
+    """How :func:`iter_traces` reconstructs the output of one render."""
+    samplerate: int
+    stride: int
+    bandwidth: float
+    taps: np.ndarray
+    bound: float
+
+    @property
+    def rate(self):
+        """Samples per second of the coarse grid actually solved."""
+        return self.samplerate/self.stride
+
+
+def bandwidth(params):
+    """Upper bound in Hz on the frequencies in the drive-free traces.
+
+    They oscillate at differences of eigenvalues of ``H0``.  By Gershgorin's
+    theorem those lie within the spread of the diagonal (z-fields and ZZ
+    couplings) widened by the hopping, at most 2 per bond on either side.
+    The decay rates are added as margin for the damped lines.
+    """
+    bonds = len(hamiltonian.geometry(params).bonds)
+    fields = np.abs(hamiltonian.gradient_field(params)).sum()
+    spread = 2*(fields + abs(params.J)*bonds) + 4*bonds
+    gamma_amp, gamma = hamiltonian.damping_rates(params)
+    return (spread + gamma_amp + 2*gamma)/(2*np.pi)
+
+
+def _scale(params, observables):
+    """Bound on ``|same|`` and ``|cross|``: the largest sum of Pauli weights."""
+    names = (params.observable,) if observables is None else observables
+    return max(sum(abs(coef) for coef, _ in hamiltonian.observable_terms(params.num_qubit, name))
+               for name in names)
+
+
+def plan(params, samplerate=SAMPLE_RATE, tol=TOLERANCE, observables=None):
+    """The coarse grid and interpolation filter for ``params`` at ``samplerate``.
+
+    ``bound`` is the resulting error bound on the expectation values: both
+    traces pick up at most the filter ripple ``delta`` from the passband
+    and from each of the ``stride - 1`` spectral images.
+    """
+    band = bandwidth(params)
+    stride = int(np.clip(samplerate // (2*OVERSAMPLE*band) if band else MAX_STRIDE, 1, MAX_STRIDE))
+    if stride == 1:
+        return Plan(samplerate, 1, band, np.ones(1), 0.0)
+    scale = _scale(params, observables)
+    delta = tol/(2*stride*scale)
+    # Frequencies as fractions of the output Nyquist rate: the traces end
+    # at ``band`` and their first image starts at ``rate - band``.
+    rate = samplerate/stride
+    width = 2*(rate - 2*band)/samplerate
+    numtaps, beta = signal.kaiserord(-20*np.log10(delta), width)
+    taps = signal.firwin(numtaps | 1, 1/stride, window=("kaiser", beta))
+    return Plan(samplerate, stride, band, taps, 2*stride*delta*scale)
+
+
+def _resample(x, plan, half, start, stop):
+    """Output samples ``start:stop`` rebuilt from the coarse trace ``x``."""
+    if x is None:
+        return None
+    a, b = start // plan.stride, -(-stop // plan.stride)
+    lo = max(a - half, 0)
+    y = signal.resample_poly(x[..., lo:b + half], plan.stride, 1, axis=-1, window=plan.taps)
+    offset = start - lo*plan.stride
+    return y[..., offset:offset + stop - start]
+
+
+def _collect(traces):
+    times, same, cross = zip(*traces)
+    join = lambda parts: None if parts[0] is None else np.concatenate(parts, axis=-1)
+    return np.concatenate(times), join(same), join(cross)
+
+
+def iter_traces(params, observables=None, samplerate=SAMPLE_RATE, tol=TOLERANCE, traces=None,
+                size=None):
+    """Yield ``(times, same, cross)`` on the output grid from a coarse solve.
+
+    ``traces`` is the backend's ``iter_traces``; by default the closed form
+    where it applies and the matrix-free propagator otherwise.  ``size``
+    stops after that many output samples.
+    """
+    if traces is None:
+        traces = closed_form.iter_traces if closed_form.applicable(params) else matrix_free.iter_traces
+    grid = audio_grid(params.T, samplerate)
+    if size is not None and size < grid.size:
+        grid = Grid(grid.step, size)
+    p = plan(params, samplerate, tol, observables)
+    metrics.note("resample", {"stride": p.stride, "rate": p.rate, "bound": p.bound})
+    if p.stride == 1:
+        yield from traces(params, observables, grid=grid)
+        return
+
+    # Input samples the filter reaches on either side of an output sample.
+    half = -(-(len(p.taps) // 2) // p.stride) + 1
+    coarse = Grid(grid.step*p.stride, (grid.size - 1) // p.stride + 1 + half)
+    _, same, cross = _collect(traces(params, observables, grid=coarse))
+    head = min(half*p.stride, grid.size)
+    _, head_same, head_cross = _collect(traces(params, observables, grid=Grid(grid.step, head)))
+
+    for start in range(0, grid.size, CHUNK_SAMPLES):
+        stop = min(start + CHUNK_SAMPLES, grid.size)
+        with metrics.stage("resample"):
+            block_same = _resample(same, p, half, start, stop)
+            block_cross = _resample(cross, p, half, start, stop)
+            if start < head:
+                block_same[..., :head - start] = head_same[..., start:stop]
+                if block_cross is not None:
+                    block_cross[..., :head - start] = head_cross[..., start:stop]
+        yield grid.times(start, stop), block_same, block_cross
+
+
+def iter_solve(params, observables=None, samplerate=SAMPLE_RATE, tol=TOLERANCE, traces=None,
+               size=None):
+    """Yield the expectation value on the grid of ``samplerate``, see :func:`iter_traces`."""
+    return with_drive(iter_traces(params, observables, samplerate, tol, traces, size), params)
+
+
+def solve(params, observables=None, samplerate=SAMPLE_RATE, tol=TOLERANCE, traces=None, size=None):
+    return np.concatenate(list(iter_solve(params, observables, samplerate, tol, traces, size)),
+                          axis=-1)
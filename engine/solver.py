@@ -0,0 +1,140 @@
+import numpy as np
+import qutip
+
+from . import (closed_form, hamiltonian, matrix_free, metrics, parareal, resample, symmetry,
+               trajectories)
+from .params import SAMPLE_RATE, num_samples, time_grid
+from .waveform import Drive
+
+METHODS = ("auto", "closed_form", "symmetry", "matrix_free", "mesolve", "parareal", "trajectories")
+# Samples per mesolve call when integrating block by block.
+MESOLVE_BLOCK = SAMPLE_RATE // 4
+
+
+def iter_mesolve(params, block_size=MESOLVE_BLOCK, observables=None):
+    """``qutip.mesolve`` over consecutive blocks, carrying the final state.
+
+    Consecutive blocks share one sample, so the drive is interpolated across
+    every block boundary.  All ``observables`` are evaluated in one
+    integration.
+    """
+    names = (params.observable,) if observables is None else tuple(observables)
+    total = num_samples(params.T)
+    drive = Drive(params)
+    state = hamiltonian.initial_state(params)
+    with metrics.stage("operators"):
+        c_ops = hamiltonian.collapse_operators(params)
+        e_ops = [hamiltonian.observable(params._replace(observable=name)) for name in names]
+    times = time_grid(params.T, 0, 1)
+    samples = drive.block(times)[0]
+    for start in range(0, total - 1, block_size):
+        new = time_grid(params.T, start + 1, start + 1 + block_size)
+        times = np.concatenate([times[-1:], new])
+        samples = np.concatenate([samples[-1:], drive.block(new)[0]])
+        with metrics.stage("qobjevo"):
+            H = hamiltonian.evolution_hamiltonian(params, times, samples)
+        with metrics.stage("mesolve"):
+            result = qutip.mesolve(H, state, times, c_ops=c_ops, e_ops=e_ops,
+                                   options={"store_final_state": True})
+        state = result.final_state
+        expectation = np.real(np.array(result.expect))
+        if observables is None:
+            expectation = expectation[0]
+        yield expectation if start == 0 else expectation[..., 1:]
+
+
+def mesolve(params, observables=None):
+    return np.concatenate(list(iter_mesolve(params, observables=observables)), axis=-1)
+
+
+def select_method(params):
+    if params.num_qubit >= symmetry.MIN_QUBITS and matrix_free.applicable(params):
+        # The sectors a state populates, not its size, decide which is cheaper.
+        if symmetry.applicable(params) and symmetry.cost(params) <= matrix_free.cost(params):
+            return "symmetry"
+        return "matrix_free"
+    if closed_form.applicable(params):
+        return "closed_form"
+    if matrix_free.applicable(params):
+        return "matrix_free"
+    return "mesolve"
+
+
+def resolve_method(params, method="auto"):
+    """The backend ``method`` stands for, checked against ``params``."""
+    if method not in METHODS:
+        raise ValueError(f"method must be one of {METHODS}, got {method!r}")
+    if method == "auto":
+        method = select_method(params)
+    if method == "closed_form" and not closed_form.applicable(params):
+        raise ValueError("these parameters do not admit a closed-form solution")
+    if method == "symmetry" and not symmetry.applicable(params):
+        raise ValueError("the symmetry sectors of these parameters are too large to diagonalize")
+    if method == "matrix_free" and not matrix_free.applicable(params):
+        raise ValueError("the matrix-free propagator does not model these collapse operators")
+    return method
+
+
+def _rechunk(blocks, size):
+    pending, count = [], 0
+    for block in blocks:
+        pending.append(block)
+        count += block.shape[-1]
+        if count < size:
+            continue
+        joined = np.concatenate(pending, axis=-1)
+        cut = count - count % size
+        yield from np.split(joined[..., :cut], cut // size, axis=-1)
+        pending, count = [joined[..., cut:]], count - cut
+    if count:
+        yield np.concatenate(pending, axis=-1)
+
+
+def iter_solve(params, method="auto", block_size=None, observables=None):
+    """Expectation value on the audio time grid, in consecutive blocks.
+
+    The ``mesolve`` path integrates forward in time and yields each stretch
+    as soon as it is computed.  The closed form, symmetry and matrix-free paths solve
+    the drive-free traces on a grid as coarse as the static Hamiltonian
+    allows and stream them back resampled to the audio rate (see
+    :mod:`engine.resample`); trajectories average whole runs and yield the
+    full signal at once.  With
+    ``block_size`` the stretches are regrouped to that many samples each
+    (the last may be shorter).
+
+    ``observables`` names several observables (see
+    :func:`engine.hamiltonian.observable_terms`) to evaluate from the same
+    evolution instead of ``params.observable``; blocks then have one row
+    per observable.  Parareal yields each segment once its start state has converged.
+    """
+    method = resolve_method(params, method)
+    if method == "closed_form":
+        blocks = resample.iter_solve(params, observables, traces=closed_form.iter_traces)
+    elif method == "symmetry":
+        blocks = resample.iter_solve(params, observables, traces=symmetry.iter_traces)
+    elif method == "matrix_free":
+        blocks = resample.iter_solve(params, observables, traces=matrix_free.iter_traces)
+    elif method == "trajectories":
+        blocks = iter([trajectories.solve(params, observables=observables)])
+    elif method == "parareal":
+        blocks = parareal.iter_solve(params, observables)
+    else:
+        blocks = iter_mesolve(params, observables=observables)
+    return _rechunk(blocks, block_size) if block_size else blocks
+
+
+def solve(params, method="auto", observables=None):
+    """Expectation value of the chosen observable on the audio time grid.
+
+    ``method="auto"`` uses the closed-form parity solution whenever the
+    Hamiltonian and collapse operators allow it on small systems.  From
+    ``symmetry.MIN_QUBITS`` spins on it weighs the same evolution split into
+    magnetization and momentum sectors (see :mod:`engine.symmetry`)
+    against the matrix-free Krylov propagator by the sectors the initial
+    state populates, and takes the cheaper one; all three treat the
+    app's amplitude and phase damping exactly, so every setting the app
+    builds is served by one of them.  ``qutip.mesolve``, its time-parallel
+    Parareal variant and parallel quantum-jump trajectories are only used
+    when asked for by ``method``.
+    """
+    return np.concatenate(list(iter_solve(params, method, observables=observables)), axis=-1)
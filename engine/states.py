@@ -0,0 +1,147 @@
+"""Initial states: validation, bulk import, generators and a compact summary.
+
+States are complex128 vectors of ``2^N`` amplitudes over the computational
+basis, site 0 being the most significant bit (see :mod:`engine.lattice`).
+Everything here works on whole arrays, so a 16-spin state of 65536
+amplitudes costs no more than a 2-spin one in Python overhead.
+"""
+import os
+import zipfile
+
+import numpy as np
+
+# Keys an .npz archive may store the state under; otherwise its only array is used.
+NPZ_KEYS = ("initstate", "state", "psi")
+
+
+def _num_qubit(size):
+    num_qubit = int(size).bit_length() - 1
+    if size < 1 or 2**num_qubit != size:
+        raise ValueError(f"a state needs a power of two amplitudes, got {size}")
+    return num_qubit
+
+
+def normalize(amplitudes, num_qubit=None):
+    """``amplitudes`` as a normalized complex128 vector of ``2^num_qubit`` entries.
+
+    Raises ValueError for the wrong length, non-finite amplitudes (an
+    unparsed entry is NaN) or the zero vector.
+    """
+    state = np.asarray(amplitudes, dtype=np.complex128).reshape(-1)
+    if num_qubit is None:
+        num_qubit = _num_qubit(len(state))
+    if state.shape != (2**num_qubit,):
+        raise ValueError(f"initstate must have {2**num_qubit} amplitudes")
+    if not np.isfinite(state).all():
+        missing = np.flatnonzero(~np.isfinite(state))
+        raise ValueError(f"{len(missing)} amplitude(s) are missing or invalid, "
+                         f"the first at |{np.binary_repr(missing[0], num_qubit)}>")
+    norm = np.linalg.norm(state)
+    if norm == 0:
+        raise ValueError("the initial state must not be the zero vector")
+    return state/norm
+
+
+def _read_csv(source):
+    """Amplitudes from CSV: one ``a+bj`` per row, or ``real,imag`` columns."""
+    if isinstance(source, (str, os.PathLike)):
+        with open(source) as f:
+            text = f.read()
+    else:
+        text = source.read()
+        if isinstance(text, bytes):
+            text = text.decode()
+    rows = [line.split("#", 1)[0].replace(" ", "") for line in text.splitlines()]
+    cells = np.loadtxt([row for row in rows if row], dtype=str, delimiter=",", ndmin=2)
+    if cells.shape[1] not in (1, 2):
+        raise ValueError("a CSV state has one complex column or real and imaginary columns")
+    try:
+        if cells.shape[1] == 1:
+            return cells[:, 0].astype(np.complex128)
+        return cells[:, 0].astype(float) + 1j*cells[:, 1].astype(float)
+    except ValueError as error:
+        raise ValueError(f"unreadable amplitude in the CSV state: {error}") from error
+
+
+def load(source, num_qubit=None, name=None):
+    """A normalized state read from a ``.npy``, ``.npz`` or ``.csv`` file.
+
+    ``source`` is a path or a binary file object; ``name`` gives the file
+    name (and so the format) of a file object.  ``.npy`` paths are
+    memory-mapped, so the only full copy made is the normalized complex128
+    vector.  Without ``num_qubit`` it is inferred from the length.
+    """
+    if name is None:
+        name = os.fspath(source) if isinstance(source, (str, os.PathLike)) else getattr(source, "name", "")
+    suffix = os.path.splitext(str(name))[1].lower()
+    try:
+        if suffix == ".npy":
+            mmap_mode = "r" if isinstance(source, (str, os.PathLike)) else None
+            amplitudes = np.load(source, mmap_mode=mmap_mode, allow_pickle=False)
+        elif suffix == ".npz":
+            with np.load(source, allow_pickle=False) as archive:
+                keys = [key for key in NPZ_KEYS if key in archive.files]
+                if not keys and len(archive.files) != 1:
+                    raise ValueError(f"store the state as one of {NPZ_KEYS} in the .npz archive")
+                amplitudes = archive[keys[0] if keys else archive.files[0]]
+        elif suffix == ".csv":
+            amplitudes = _read_csv(source)
+        else:
+            raise ValueError(f"unsupported state file {name!r}, use .npy, .npz or .csv")
+    except (OSError, EOFError, zipfile.BadZipFile) as error:
+        raise ValueError(f"could not read {name!r}: {error}") from error
+    return normalize(amplitudes, num_qubit)
+
+
+def _ones(num_qubit):
+    """Number of 1 bits of every basis index."""
+    basis = np.arange(2**num_qubit)
+    return sum((basis >> i) & 1 for i in range(num_qubit))
+
+
+def product_state(num_qubit, theta=np.pi/2, phi=0.0):
+    """Every spin at polar angle ``theta`` and azimuth ``phi`` on the Bloch sphere.
+
+    The default points every spin along +x, which is the app's default
+    uniform superposition.
+    """
+    ones = _ones(num_qubit)
+    return (np.cos(theta/2)**(num_qubit - ones)*np.sin(theta/2)**ones*np.exp(1j*phi*ones)
+            ).astype(np.complex128)
+
+
+def basis_state(bits):
+    """The computational basis state of a bit string such as ``"0110"``."""
+    if not bits or set(bits) - {"0", "1"}:
+        raise ValueError(f"a basis state is a string of 0s and 1s, got {bits!r}")
+    state = np.zeros(2**len(bits), dtype=np.complex128)
+    state[int(bits, 2)] = 1
+    return state
+
+
+def neel(num_qubit):
+    """The Neel state ``|0101...>`` of alternating spins."""
+    return basis_state(("01"*num_qubit)[:num_qubit])
+
+
+def random_haar(num_qubit, seed=None):
+    """A state drawn uniformly (Haar) from the unit sphere, reproducibly per ``seed``."""
+    rng = np.random.default_rng(seed)
+    d = 2**num_qubit
+    return normalize(rng.normal(size=d) + 1j*rng.normal(size=d), num_qubit)
+
+
+def top_amplitudes(state, k=8):
+    """``(index, amplitude)`` of the ``k`` largest amplitudes, largest first.
+
+    Selection is linear in the size of the state; only the ``k`` winners
+    are sorted.  States of at most ``k`` amplitudes come back in basis
+    order.
+    """
+    state = np.asarray(state)
+    if len(state) <= k:
+        return [(i, state[i]) for i in range(len(state))]
+    magnitude = np.abs(state)
+    index = np.argpartition(magnitude, -k)[-k:]
+    index = index[np.argsort(-magnitude[index], kind="stable")]
+    return [(int(i), state[i]) for i in index]
@@ -0,0 +1,62 @@
+"""Block-wise rendering: PCM chunks are produced while the solver runs.
+
+Only the current block of the signal and the solver state are held, so
+memory stays flat however long the render, and the first audio is
+available after one block instead of after the whole solve.
+"""
+import struct
+
+import numpy as np
+
+from . import metrics
+from .audio import Limiter
+from .params import SAMPLE_RATE, num_samples
+
+BLOCK_SECONDS = 0.25
+
+
+def pcm_blocks(params, method="auto", block_size=None, limiter=None, mix=None):
+    """Yield ``(signal, pcm16)`` per block of the audio grid.
+
+    ``signal`` is the float32 expectation value.  With a
+    :class:`~engine.audio.Mix` every observable of the mix is solved and
+    mixed down right away, so ``signal`` and the PCM block have one column
+    per channel and the per-observable rows are never kept.
+    """
+    from .solver import iter_solve
+
+    block_size = block_size or int(BLOCK_SECONDS*SAMPLE_RATE)
+    limiter = limiter or Limiter()
+    observables = None if mix is None else mix.observables
+    gains = None if mix is None else mix.matrix()
+    with metrics.stage("solve"):
+        blocks = iter_solve(params, method, block_size, observables=observables)
+    while True:
+        with metrics.stage("solve"):
+            block = next(blocks, None)
+        if block is None:
+            return
+        if mix is not None:
+            with metrics.stage("mix"):
+                block = block.T @ gains
+        signal = block.astype(np.float32)
+        yield signal, limiter.pcm16(signal)
+
+
+def wav_header(num_samples, samplerate=SAMPLE_RATE, channels=1):
+    """44-byte RIFF header of a 16-bit PCM file with interleaved channels."""
+    data = 2*channels*num_samples
+    return struct.pack('<4sI4s4sIHHIIHH4sI', b'RIFF', 36 + data, b'WAVE', b'fmt ', 16,
+                       1, channels, samplerate, 2*channels*samplerate, 2*channels, 16,
+                       b'data', data)
+
+
+def wav_chunks(params, method="auto", block_size=None, limiter=None, mix=None):
+    """The WAV file of ``params`` as a stream of bytes chunks.
+
+    The sample count is known in advance, so the header goes out first and
+    every later chunk is raw little-endian PCM.
+    """
+    yield wav_header(num_samples(params.T), channels=1 if mix is None else mix.channels)
+    for _, pcm in pcm_blocks(params, method, block_size, limiter, mix):
+        yield pcm.astype('<i2').tobytes()
@@ -0,0 +1,58 @@
+"""Solve many parameter sets of one spin system in a single pass.
+
+The drive couples only to the global parity, so with the closed-form,
+symmetry and matrix-free backends it enters expectation values as a phase on the
+drive-free traces of :func:`engine.closed_form.iter_traces`.  Settings
+that differ only in the drive (B0, amplitude, frequency, waveform, noise)
+therefore share one propagation, and each extra setting costs a pass over
+its drive samples.  Settings with different static parts (J, gradients,
+initial state, damping, observable) are propagated once per distinct part,
+on the same coarse grid :func:`engine.solver.solve` resamples from.
+"""
+import numpy as np
+
+from . import closed_form, matrix_free, resample, solver, symmetry
+from .params import num_samples
+
+BACKENDS = {"closed_form": closed_form, "symmetry": symmetry, "matrix_free": matrix_free}
+
+
+def static_key(params):
+    """Cache key of ``params`` with the drive settings blanked out."""
+    return params._replace(B0=0.0, amp=0.0, waveform="sine", duty=0.5, w=1.0, f=0.0,
+                           noise_std=0.0, noise_seed=None, noise_color="white",
+                           noise_tau=0.0).key()
+
+
+def run_sweep(params_list, method="auto"):
+    """Expectation traces of every parameter set, one row each.
+
+    All sets must describe the same lattice and duration.  Sets that the
+    ``mesolve`` or trajectory backends have to handle are solved one by one.
+    """
+    params_list = list(params_list)
+    if not params_list:
+        raise ValueError("sweep needs at least one parameter set")
+    first = params_list[0]
+    shared = ("dim", "num_qubit", "size", "periodic", "T")
+    for params in params_list[1:]:
+        for field in shared:
+            if getattr(params, field) != getattr(first, field):
+                raise ValueError(f"all parameter sets in a sweep must share {field}")
+
+    groups = {}
+    for i, params in enumerate(params_list):
+        groups.setdefault(static_key(params), []).append(i)
+
+    out = np.empty((len(params_list), num_samples(first.T)))
+    for rows in groups.values():
+        lead = params_list[rows[0]]
+        backend = BACKENDS.get(solver.resolve_method(lead, method))
+        if backend is None:
+            for i in rows:
+                out[i] = solver.solve(params_list[i], method)
+            continue
+        traces = list(resample.iter_traces(lead, traces=backend.iter_traces))
+        for i in rows:
+            out[i] = np.concatenate(list(closed_form.with_drive(traces, params_list[i])))
+    return out
@@ -0,0 +1,266 @@
+"""Evolution block by block in the symmetry sectors of the static Hamiltonian.
+
+Hopping swaps a flipped spin with its neighbour, and the ZZ couplings and
+z-fields are diagonal, so every term of ``H0`` conserves the number of
+flipped spins, i.e. the magnetization.  The global parity the drive
+couples to is fixed by it, so on a sector ``H(t)`` is ``H0`` plus the
+constant ``B(t)`` or ``-B(t)``.  On a periodic chain without a gradient
+``H0`` also commutes with translation by one site, and every magnetization
+splits further into momentum sectors ``k = 2 pi q / N``.  A state built
+from ``|b>`` with translation period ``R`` only exists for ``q R = 0
+(mod N)``, as ``R^(-1/2) sum_{j<R} exp(-i k j) T^j |b>``.
+
+Only the sectors the initial state populates are diagonalized, each one
+independently on a thread pool (LAPACK releases the GIL).  The default
+initial state is translation invariant and populates only ``q = 0``, so
+a ring of N spins costs about ``2^N / N`` amplitudes per sample instead of
+``2^N``.  Observables are projected onto pairs of populated sectors once,
+and expectation values come out as the ``(times, same, cross)`` traces of
+:func:`engine.closed_form.iter_traces`, with dephasing and the collective
+lowering operator handled the same way: ``|0...0>`` and ``|1...1>`` are
+sectors of their own.
+"""
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+
+import numpy as np
+from scipy import sparse
+
+from . import hamiltonian, metrics
+from .closed_form import BLOCK, CHUNK_ELEMENTS, MAX_CHUNK_SAMPLES, with_drive
+from .params import audio_grid
+
+MAX_QUBITS = 16
+# From this size on the sectors beat one eigendecomposition per parity.
+MIN_QUBITS = 9
+# Largest sector worth a dense eigendecomposition.
+MAX_SECTOR = 2048
+# Weights of :func:`cost` against :func:`engine.matrix_free.cost`, fitted
+# to chains of 9 to 16 spins: a dense amplitude of a populated sector, and
+# the sparse products of one pair of sectors in :func:`_couplings`.
+DENSE_WEIGHT = 0.25
+PAIR_WEIGHT = 200
+
+
+class Sector(NamedTuple):
+    """States with ``ones`` flipped spins and, on a ring, momentum ``2 pi q / N``."""
+    ones: int
+    q: int | None
+    basis: sparse.csr_matrix   # 2^N x dim isometry onto the sector
+
+    @property
+    def parity(self):
+        return 1 - 2*(self.ones % 2)
+
+    def __len__(self):
+        return self.basis.shape[1]
+
+
+def translation_invariant(params):
+    """True if ``H0`` commutes with translation along a ring."""
+    geo = hamiltonian.geometry(params)
+    fields = hamiltonian.gradient_field(params)
+    return geo.Ly == 1 and geo.periodic and np.ptp(fields) == 0
+
+
+@functools.lru_cache(maxsize=8)
+def orbits(num_qubit):
+    """Representative, period and offset of every basis state under translation.
+
+    State ``b`` is the representative (the smallest state of its orbit)
+    translated ``offset`` times by one site.
+    """
+    n = num_qubit
+    basis = np.arange(2**n, dtype=np.int64)
+    shifted = np.empty((n, len(basis)), dtype=np.int64)
+    shifted[0] = basis
+    for j in range(1, n):
+        shifted[j] = (shifted[j - 1] >> 1) | ((shifted[j - 1] & 1) << (n - 1))
+    steps = shifted.argmin(axis=0)
+    rep = shifted[steps, basis]
+    # The n-th translation always returns, so every column has a match.
+    back = np.vstack([shifted[1:], basis]) == basis
+    period = back.argmax(axis=0) + 1
+    return rep, period, -steps % period
+
+
+@functools.lru_cache(maxsize=8)
+def sectors(num_qubit, translation=False):
+    """Every :class:`Sector` of ``num_qubit`` spins, with momenta if ``translation``."""
+    n = num_qubit
+    d = 2**n
+    ones = np.array([bin(b).count("1") for b in range(d)])
+    found = []
+    if not translation:
+        for m in range(n + 1):
+            states = np.flatnonzero(ones == m)
+            basis = sparse.csr_matrix((np.ones(len(states), dtype=complex),
+                                       (states, np.arange(len(states)))), shape=(d, len(states)))
+            found.append(Sector(m, None, basis))
+        return tuple(found)
+    rep, period, offset = orbits(n)
+    for q in range(n):
+        allowed = q*period % n == 0
+        for m in range(n + 1):
+            states = np.flatnonzero(allowed & (ones == m))
+            if not len(states):
+                continue
+            _, column = np.unique(rep[states], return_inverse=True)
+            data = np.exp(-2j*np.pi*q*offset[states]/n)/np.sqrt(period[states])
+            basis = sparse.csr_matrix((data, (states, column)), shape=(d, column.max() + 1))
+            found.append(Sector(m, q, basis))
+    return tuple(found)
+
+
+def populated(params, atol=1e-14):
+    """Sectors the initial state of ``params`` has weight in, with its coefficients there."""
+    psi0 = np.asarray(params.initstate, dtype=complex)
+    found = []
+    for sector in sectors(params.num_qubit, translation_invariant(params)):
+        c = sector.basis.conj().T @ psi0
+        if np.linalg.norm(c) > atol:
+            found.append((sector, c))
+    return found
+
+
+def applicable(params):
+    """True if every populated sector is small enough and the collapse operators fit."""
+    if params.num_qubit > MAX_QUBITS:
+        return False
+    if not all(kind in ("amplitude", "phase") for kind, _ in params.c_ops):
+        return False
+    return max(len(sector) for sector, _ in populated(params)) <= MAX_SECTOR
+
+
+def cost(params):
+    """Work of a render in the units of :func:`engine.matrix_free.cost`.
+
+    Dense work grows with the squared sizes of the populated sectors, the
+    per-sample overhead with the number of pairs of them: a translation
+    invariant state populates a handful of sectors, a random one nearly all.
+    """
+    sizes = [len(sector) for sector, _ in populated(params)]
+    return DENSE_WEIGHT*sum(size**2 for size in sizes) + PAIR_WEIGHT*len(sizes)**2
+
+
+def _diagonalize(H0, sector):
+    block = (sector.basis.conj().T @ H0 @ sector.basis).toarray()
+    # Momenta 0 and pi have real blocks, which diagonalize several times faster.
+    if not np.any(block.imag):
+        block = block.real
+    return np.linalg.eigh(block)
+
+
+def eigensystems(params, workers=None, executor=None):
+    """``(sector, c, E, V)`` of every populated sector, diagonalized in parallel.
+
+    ``c`` are the initial amplitudes in the eigenbasis ``V`` of the sector,
+    restricted to the eigenvectors the initial state has weight in.  Pass
+    ``executor`` to share a pool; otherwise ``workers`` threads (default:
+    all cores) live for one call.
+    """
+    H0 = hamiltonian.static_matrix(params)
+    found = populated(params)
+    own = executor is None
+    if own:
+        executor = ThreadPoolExecutor(workers or os.cpu_count())
+    try:
+        futures = [executor.submit(_diagonalize, H0, sector) for sector, _ in found]
+        systems = []
+        for (sector, c), future in zip(found, futures):
+            E, V = future.result()
+            c = V.conj().T @ c
+            keep = np.abs(c) > 1e-14
+            systems.append((sector, c[keep], E[keep], V[:, keep]))
+    finally:
+        if own:
+            executor.shutdown()
+    return systems
+
+
+def _couplings(systems, num_qubit, names):
+    """Observables between populated sectors as ``(bra, ket, blocks)``.
+
+    ``blocks[j]`` is observable ``j`` in the sector bases, or None where it
+    vanishes.  Pairs of opposite parity are kept with the even sector on
+    the bra side only; their other half is the complex conjugate.
+    """
+    matrices = [hamiltonian.observable_matrix(num_qubit, name) for name in names]
+    pairs = []
+    for b, (ket, *_) in enumerate(systems):
+        images = [O @ ket.basis for O in matrices]
+        for a, (bra, *_) in enumerate(systems):
+            if bra.parity != ket.parity and bra.parity < 0:
+                continue
+            blocks = [(bra.basis.conj().T @ image).tocsr() for image in images]
+            blocks = [block if block.count_nonzero() else None for block in blocks]
+            if any(block is not None for block in blocks):
+                pairs.append((a, b, blocks))
+    return pairs
+
+
+def iter_traces(params, observables=None, grid=None, workers=None, executor=None):
+    """Yield ``(times, same, cross)`` over consecutive chunks of the time grid.
+
+    Same contract as :func:`engine.closed_form.iter_traces`; ``workers``
+    and ``executor`` are passed to :func:`eigensystems`.
+    """
+    names = (params.observable,) if observables is None else tuple(observables)
+    n = params.num_qubit
+    gamma_amp, gamma = hamiltonian.damping_rates(params)
+    with metrics.stage("operators"):
+        systems = eigensystems(params, workers, executor)
+        pairs = _couplings(systems, n, names)
+        ground = np.array([hamiltonian.observable_matrix(n, name)[0, 0].real for name in names])
+
+    c = np.concatenate([system[1] for system in systems])
+    E = np.concatenate([system[2] for system in systems])
+    bounds = np.cumsum([0] + [len(system[1]) for system in systems])
+    top = next((i for i, system in enumerate(systems) if system[0].ones == n), None)
+    weight = abs(params.initstate[-1])**2
+
+    grid = grid or audio_grid(params.T)
+    total, dt = grid.size, grid.step
+    offsets = np.exp(-1j*np.outer(np.arange(BLOCK)*dt, E))
+
+    step = min(MAX_CHUNK_SAMPLES, max(1, CHUNK_ELEMENTS // (BLOCK*len(E)))*BLOCK)
+    for start in range(0, total, step):
+        with metrics.stage("traces"):
+            times = grid.times(start, start+step)
+            k = len(times)
+            phases = c*np.exp(-1j*np.outer(np.arange(start, start+k, BLOCK)*dt, E))
+            amps = (phases[:, None, :]*offsets[None, :, :]).reshape(-1, len(c))[:k]
+            if gamma_amp and top is not None:
+                amps[:, bounds[top]:bounds[top + 1]] *= np.exp(-gamma_amp*times[:, None]/2)
+            psi = [V @ amps[:, lo:hi].T for (_, _, _, V), lo, hi in zip(systems, bounds, bounds[1:])]
+            same = np.zeros((len(names), k))
+            cross = np.zeros((len(names), k), dtype=complex)
+            for a, b, blocks in pairs:
+                opposite = systems[a][0].parity != systems[b][0].parity
+                for j, block in enumerate(blocks):
+                    if block is None:
+                        continue
+                    value = np.einsum("ij,ij->j", psi[a].conj(), block @ psi[b])
+                    if opposite:
+                        cross[j] += 2*value
+                    else:
+                        same[j] += value.real
+            if gamma:
+                cross *= np.exp(-2*gamma*times)
+            if gamma_amp:
+                same += np.outer(ground, weight*(1 - np.exp(-gamma_amp*times)))
+        if observables is None:
+            yield times, same[0], cross[0]
+        else:
+            yield times, same, cross
+
+
+def iter_solve(params, observables=None):
+    """Yield the expectation value over consecutive chunks of the time grid."""
+    return with_drive(iter_traces(params, observables), params)
+
+
+def solve(params, observables=None):
+    return np.concatenate(list(iter_solve(params, observables)), axis=-1)
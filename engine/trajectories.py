@@ -0,0 +1,94 @@
+"""Quantum-jump trajectories for open systems, spread over a process pool.
+
+``mesolve`` evolves a 4^N-entry density matrix on one core.  Here batches
+of ``qutip.mcsolve`` trajectories, each only a 2^N state vector, run in
+worker processes and their running average is streamed back as batches
+complete.  Batches are seeded from one ``SeedSequence``, so a given
+``(params, ntraj, seed, batch_size)`` always averages the same trajectories.
+"""
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import NamedTuple
+
+import numpy as np
+import qutip
+
+from . import hamiltonian
+from .params import time_grid
+
+NTRAJ = 128
+BATCH_SIZE = 8
+
+
+class Partial(NamedTuple):
+    done: int
+    total: int
+    expectation: np.ndarray
+
+
+def default_seed(params):
+    return int(params.key()[:8], 16)
+
+
+def run_batch(params, ntraj, seed, observables=None):
+    """Sum of the observable over ``ntraj`` trajectories.
+
+    With ``observables`` every one is evaluated on the same trajectories,
+    one row each.
+    """
+    names = (params.observable,) if observables is None else tuple(observables)
+    times = time_grid(params.T)
+    result = qutip.mcsolve(
+        hamiltonian.evolution_hamiltonian(params, times),
+        hamiltonian.initial_state(params), times,
+        c_ops=hamiltonian.collapse_operators(params),
+        e_ops=[hamiltonian.observable(params._replace(observable=name)) for name in names],
+        ntraj=ntraj, seeds=seed,
+        options={"progress_bar": False, "map": "serial"},
+    )
+    expectation = np.real(np.array(result.expect))*ntraj
+    return expectation[0] if observables is None else expectation
+
+
+def stream(params, ntraj=NTRAJ, seed=None, batch_size=BATCH_SIZE, workers=None, executor=None,
+           observables=None):
+    """Yield a :class:`Partial` average every time a batch of trajectories finishes.
+
+    Pass ``executor`` to share a pool between calls; otherwise a pool of
+    ``workers`` processes (default: all cores) lives for one stream.  The
+    final partial sums the batches in a fixed order so that it does not
+    depend on completion order.  ``observables`` are passed to
+    :func:`run_batch`.
+    """
+    if seed is None:
+        seed = default_seed(params)
+    sizes = [batch_size]*(ntraj // batch_size)
+    if ntraj % batch_size:
+        sizes.append(ntraj % batch_size)
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+
+    own = executor is None
+    if own:
+        executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"))
+    try:
+        futures = {executor.submit(run_batch, params, n, s, observables): i
+                   for i, (n, s) in enumerate(zip(sizes, seeds))}
+        sums = [None]*len(sizes)
+        running, done = 0, 0
+        for future in as_completed(futures):
+            i = futures[future]
+            sums[i] = future.result()
+            running = running + sums[i]
+            done += sizes[i]
+            if done == ntraj:
+                running = sum(sums[1:], sums[0])
+            yield Partial(done, ntraj, running/done)
+    finally:
+        if own:
+            executor.shutdown(cancel_futures=True)
+
+
+def solve(params, ntraj=NTRAJ, seed=None, observables=None, **kwargs):
+    for partial in stream(params, ntraj, seed, observables=observables, **kwargs):
+        pass
+    return partial.expectation
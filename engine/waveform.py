@@ -0,0 +1,91 @@
+import numpy as np
+from scipy import signal
+from scipy.integrate import cumulative_trapezoid
+
+from .noise import Noise
+
+
+def noise_signal(params, times):
+    return Noise(params).block(times)
+
+
+def shape(params, times):
+    """Unit-amplitude waveform of the drive evaluated on ``times`` in one pass."""
+    f = params.f
+    if params.waveform == "sine":
+        return np.sin(2*np.pi*f*times)
+    if params.waveform == "square":
+        return signal.square(2*np.pi*f*times, params.duty)
+    return signal.sawtooth(2*np.pi*f*(times+1/f), params.w)
+
+
+def drive_samples(params, times):
+    """Drive field B(t) on the full time grid, precomputed for array coefficients."""
+    return Drive(params).block(times)[0]
+
+
+def interpolation_order(params):
+    """Spline order that reproduces the drive between samples.
+
+    A cubic spline is exact to well below solver tolerance for the smooth
+    sine drive; square and sawtooth edges and the piecewise-linear noise
+    need linear interpolation to avoid ringing.
+    """
+    if params.waveform == "sine" and not params.noise_std:
+        return 3
+    return 1
+
+
+def shape_integral(params, times):
+    """Integral of :func:`shape` from 0 to each t, in closed form."""
+    f = params.f
+    u = f*times
+    frac = u - np.floor(u)
+    if params.waveform == "sine":
+        return (1 - np.cos(2*np.pi*u)) / (2*np.pi*f)
+    if params.waveform == "square":
+        duty = params.duty
+        return (np.floor(u)*(2*duty - 1) + np.where(frac < duty, frac, 2*duty - frac)) / f
+    w = params.w
+    rise = -frac + frac**2/w
+    if w < 1:
+        fall = (frac - w) - (frac - w)**2/(1 - w)
+        rise = np.where(frac < w, rise, fall)
+    return rise / f
+
+
+class Drive:
+    """The drive evaluated over consecutive slices of the time grid.
+
+    Slices must be requested in order and without gaps, starting at t = 0.
+    The seeded noise stream and its accumulated phase are carried from one
+    slice to the next, so any split of the grid gives the same samples as
+    one call over the whole grid.
+    """
+
+    def __init__(self, params):
+        self.params = params
+        self._noise = Noise(params) if params.noise_std else None
+        self._tail = None
+        self._noise_phase = 0.0
+
+    def block(self, times):
+        """``(B, Phi)``: drive field and its integral from 0, on ``times``.
+
+        The deterministic part is integrated in closed form; the noise of
+        :mod:`engine.noise` is linearly interpolated between grid points, so
+        the trapezoid rule is exact for it.
+        """
+        p = self.params
+        B = p.B0 + p.amp*shape(p, times)
+        phase = p.B0*times + p.amp*shape_integral(p, times)
+        if self._noise is not None and len(times):
+            noise = self._noise.block(times)
+            prev_t, prev_noise = self._tail or (times[0], noise[0])
+            accumulated = self._noise_phase + cumulative_trapezoid(
+                np.concatenate([[prev_noise], noise]), np.concatenate([[prev_t], times]))
+            self._tail = times[-1], noise[-1]
+            self._noise_phase = accumulated[-1]
+            B = B + noise
+            phase = phase + accumulated
+        return B, phase
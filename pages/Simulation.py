@@ -1,18 +1,50 @@
+import io
+import os
+import pstats
+import tempfile
+import time
+import uuid
+
 import streamlit as st
 import numpy as np
-import qutip
-import io
-import soundfile as sf
-from scipy import signal
-from scipy.interpolate import interp1d
+
+import engine
+from engine import lattice, states
+from engine.bank import SoundBank
 
 st.set_page_config(page_title="Larmor Precession")
 st.sidebar.header("Larmor Precession")
 
 st.title("Larmor Precession")
 
+if "render_cache" not in st.session_state:
+    st.session_state.render_cache = engine.LRUCache(8, maxbytes=128*2**20)
+if "noise_seed" not in st.session_state:
+    st.session_state.noise_seed = int(np.random.randint(2**31))
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
+
+
+@st.cache_resource
+def sound_bank():
+    #Pre-rendered grid built with `python -m engine.bank`, if one is deployed
+    path = os.environ.get("QMUSIC_SOUNDBANK", "soundbank")
+    return SoundBank(path) if os.path.isdir(path) else None
+
+
+@st.cache_data
+def imported_state(data, name, num_qubit):
+    #Parsed once per uploaded file rather than on every rerun
+    return states.load(io.BytesIO(data), num_qubit, name=name)
+
 
-#For now the maximum number of qubits is 4
+@st.cache_resource
+def render_pool():
+    #One pool of worker processes shared by every session on this server
+    return engine.RenderPool()
+
+
+#For now the maximum number of qubits is 16
 #Default is 1
 
 st.header("Basic Setup", divider=True)
@@ -20,20 +52,29 @@ dim = st.radio(
     "Dimension of the spin system",
     ["***1D Chain***", "***2D Square Lattice***"],
     captions=[
-        "You are free to choose the number of spins from 1 to 4. The model is assumed to be periodic.",
-        "For now the 2D lattice is assumed to have 4 spins."
+        "You are free to choose the number of spins from 1 to 16. The model is assumed to be periodic.",
+        "Choose the width and height of the lattice, with open or periodic boundaries."
     ],
 )
 
+size = None
+periodic = None
 if dim == "***1D Chain***":
     st.image("spinChain.jpg", caption="1D Spin Chain Diagram")
     num_qubit = st.select_slider(
         "Number of qubits",
-        options = [1, 2, 3, 4]
+        options = list(range(1, 17))
     )
 else:
-    num_qubit = 4
     st.image("spinLattice.jpg", caption="2D Spin Lattice Diagram")
+    col_x, col_y = st.columns(2)
+    with col_x:
+        width = st.select_slider("Lattice width", options = [2, 3])
+    with col_y:
+        height = st.select_slider("Lattice height", options = [2, 3])
+    periodic = st.checkbox("Periodic boundaries")
+    size = (width, height)
+    num_qubit = width*height
 
 factor_default = 1/np.sqrt(2**num_qubit)
 initstate_default = np.ones(2**num_qubit)*factor_default
@@ -42,57 +83,87 @@ initstate = initstate_default
 st.header("Initial State", divider=True)
 st.markdown(r"The default initial state is $a_i = \frac{1}{\sqrt{2^N}}\forall i$, where $N$ is the number of qubits.")
 
+initstate_modes = ["***Use default initial state***", "***Customize initial state***", "***Randomize initial state***", "***Generate initial state***", "***Import initial state***"]
+#Typing in amplitudes one by one is only offered for small systems
+if num_qubit > 4:
+    initstate_modes.remove("***Customize initial state***")
 initstate_mode = st.radio(
     "Select the initial state",
-    ["***Use default initial state***", "***Customize initial state***", "***Randomize initial state***"],
+    initstate_modes,
 )
+#States chosen with a button are kept across reruns until the number of qubits changes
+custom_state = st.session_state.get("custom_state")
+if custom_state is None or len(custom_state) != 2**num_qubit:
+    st.session_state.custom_state = None
+
 if initstate_mode == "***Customize initial state***":
     st.markdown(r"The initial state of the system takes the form $a_{0...0}|0...0\rangle+a_{0...1}|0...1\rangle+...+a_{1...1}|1...1\rangle$. Please enter the coeffcients a_i below, we'll do the normalization for you. Use $j$ for complex numbers (For example, $2+3j$). These numbers determine the quantum state of the particles.")
     col1, col2 = st.columns(2)
-    tempinit = np.array([None]*(2**num_qubit))
-
-    count1 = 0
-    with col1:
-        while count1 <= 2**num_qubit-1:
-            temp = st.text_input(rf"$a_{{{bin(count1)[2:].zfill(num_qubit)}}}$")
-            if temp != '':
-                try:
-                    tempinit[count1] = complex(temp)
-                except ValueError:
-                    st.error("Invalid Input!!!")
-            count1 = count1 + 2
-
-    count2 = 1
-    with col2:
-        while count2 <= 2**num_qubit-1:
-            temp = st.text_input(rf"$a_{{{bin(count2)[2:].zfill(num_qubit)}}}$")
-            if temp != '':
-                try:
-                    tempinit[count2] = complex(temp)
-                except ValueError:
-                    st.error("Invalid Input!!!")
-            count2 = count2 + 2
+    tempinit = np.full(2**num_qubit, np.nan, dtype=complex)
+
+    for i in range(2**num_qubit):
+        with col1 if i % 2 == 0 else col2:
+            temp = st.text_input(rf"$a_{{{bin(i)[2:].zfill(num_qubit)}}}$")
+        if temp != '':
+            try:
+                tempinit[i] = complex(temp)
+            except ValueError:
+                st.error("Invalid Input!!!")
 
     Done = st.button("Done")
 
-    if Done == True and (tempinit == None).any():
-        st.error("Did you forget to enter some of the coefficients/enter any invalid coefficients?")
-    elif Done == True and (tempinit == None).any() == False:
-        norm = np.linalg.norm(abs(tempinit))
-        initstate = tempinit/norm
+    if Done == True:
+        try:
+            st.session_state.custom_state = states.normalize(tempinit, num_qubit)
+        except ValueError as error:
+            st.error(f"Did you forget to enter some of the coefficients/enter any invalid coefficients? ({error})")
+    if st.session_state.custom_state is not None:
+        initstate = st.session_state.custom_state
 
 if initstate_mode == "***Randomize initial state***":
     Random = st.button ("Randomize")
-    if Random == True:
-        initstate = np.random.uniform(-1, 1, 2**num_qubit) + 1.j* np.random.uniform(-1, 1, 2**num_qubit)
-        norm = np.linalg.norm(abs(initstate))
-        initstate = initstate/norm
-
-initstate_string=f"{initstate[0]}|"+"0"*num_qubit+r"\rangle"
-for i in range(1, 2**num_qubit):
-    initstate_string = initstate_string + rf"+{initstate[i]}|{bin(i)[2:].zfill(num_qubit)}\rangle"
-
-st.markdown(rf"The initial state is: ${initstate_string}$")
+    if Random == True or "haar_seed" not in st.session_state:
+        st.session_state.haar_seed = int(np.random.randint(2**31))
+    #Drawn uniformly from all states (Haar measure), reproducible from its seed
+    initstate = states.random_haar(num_qubit, st.session_state.haar_seed)
+
+if initstate_mode == "***Generate initial state***":
+    generator = st.selectbox(
+    "State",
+    ("Product State", "Néel State", "Basis State"),)
+    if generator == "Product State":
+        st.markdown(r"Every spin points along the same direction $(\theta, \phi)$ on the Bloch sphere; $\theta = \pi/2, \phi = 0$ is the default state.")
+        col_theta, col_phi = st.columns(2)
+        with col_theta:
+            theta = st.select_slider(r"$\theta/\pi$", options=[0, 0.125, 0.25, 0.375, 0.5, 0.625, 0.75, 0.875, 1], value=0.5)
+        with col_phi:
+            phi = st.select_slider(r"$\phi/\pi$", options=[0, 0.25, 0.5, 0.75, 1, 1.25, 1.5, 1.75], value=0)
+        initstate = states.product_state(num_qubit, theta*np.pi, phi*np.pi)
+    elif generator == "Néel State":
+        initstate = states.neel(num_qubit)
+    else:
+        bits = st.text_input("Spins, from the first to the last", value="0"*num_qubit, max_chars=num_qubit)
+        if len(bits) == num_qubit and set(bits) <= {"0", "1"}:
+            initstate = states.basis_state(bits)
+        else:
+            st.error(f"Enter exactly {num_qubit} digits, each 0 or 1.")
+
+if initstate_mode == "***Import initial state***":
+    st.markdown(r"Upload the $2^N$ coefficients a_i in the order $|0...0\rangle, |0...1\rangle, ..., |1...1\rangle$: a `.npy` array, an `.npz` archive holding one array (or one named `initstate`), or a CSV file with either one complex number (e.g. `2+3j`) or a real and an imaginary column per row. We'll do the normalization for you.")
+    uploaded = st.file_uploader("State file", type=["npy", "npz", "csv"])
+    if uploaded is not None:
+        try:
+            initstate = imported_state(uploaded.getvalue(), uploaded.name, num_qubit)
+        except ValueError as error:
+            st.error(f"Could not use this file: {error}")
+
+#Only the largest amplitudes are written out, so large states do not stall the page
+terms = states.top_amplitudes(initstate, 16)
+initstate_string = "+".join(rf"({a:.4f})|{bin(i)[2:].zfill(num_qubit)}\rangle" for i, a in terms)
+if len(initstate) <= 16:
+    st.markdown(rf"The initial state is: ${initstate_string}$")
+else:
+    st.markdown(rf"The initial state, its 16 largest of $2^{{{num_qubit}}}$ amplitudes: ${initstate_string}+\dots$")
 
 st.header("Simulation Time", divider = True)
 T = st.select_slider(
@@ -102,9 +173,11 @@ T = st.select_slider(
         2,
         3,
         4,
-        5
+        5,
+        10,
+        30,
+        60
     ],)
-times = np.linspace(0, T, 44100*T)
 
 st.header("Magnetic Field", divider=True)
 
@@ -237,6 +310,8 @@ J = st.select_slider("J", options = [
 ])
 
 noise = st.checkbox("Add Noise to B-field")
+noise_color = "White"
+tau = 0
 if noise==True:
     std = st.select_slider(
     "Standard Deviation of Gaussian Noise",
@@ -246,68 +321,31 @@ if noise==True:
             150,
             200
     ],)
-    noise_sig = noise*np.random.normal(0,std, len(times))
-    noise_interp = interp1d(
-    times,
-    noise_sig,
-    bounds_error=False,
-    fill_value=(noise_sig[0], noise_sig[-1])
+    noise_color = st.radio(
+        "Noise Spectrum",
+        ["White", "Pink", "Brown", "Ornstein-Uhlenbeck"],
+        captions=[
+            "Independent samples.",
+            "1/f noise, equal power per octave.",
+            "A random walk, spreading by the deviation above every second.",
+            "Gaussian noise correlated over a set time.",
+        ],
+        horizontal=True,
     )
-
-if dim == "***1D Chain***":
-    space_dependentH = 0*qutip.tensor([qutip.qeye(2) for _ in range(num_qubit)])
-    obs_sum = space_dependentH
-    for i in range(num_qubit):
-        sx_i=qutip.tensor([qutip.sigmax() if j==i else qutip.qeye(2) for j in range(num_qubit)])
-        sy_i=qutip.tensor([qutip.sigmay() if j==i else qutip.qeye(2) for j in range(num_qubit)])
-        sz_i=qutip.tensor([qutip.sigmaz() if j==i else qutip.qeye(2) for j in range(num_qubit)])
-        j=(i+1)%num_qubit
-        sx_j=qutip.tensor([qutip.sigmax() if j==k else qutip.qeye(2) for k in range(num_qubit)])
-        sy_j=qutip.tensor([qutip.sigmay() if j==k else qutip.qeye(2) for k in range(num_qubit)])
-        sz_j=qutip.tensor([qutip.sigmaz() if j==k else qutip.qeye(2) for k in range(num_qubit)])
-        obs_sum = obs_sum + sy_i
-        space_dependentH = space_dependentH + grad*i*sz_i + sx_i * sx_j + sy_i * sy_j + sz_i * sz_j * J
-else:
-    space_dependentH = 0*qutip.tensor([qutip.qeye(2) for _ in range(num_qubit)])
-    obs_sum = space_dependentH
-    len = int(np.sqrt(num_qubit))
-    for i in range(num_qubit):
-        sx_i=qutip.tensor([qutip.sigmax() if j==i else qutip.qeye(2) for j in range(num_qubit)])
-        sy_i=qutip.tensor([qutip.sigmay() if j==i else qutip.qeye(2) for j in range(num_qubit)])
-        sz_i=qutip.tensor([qutip.sigmaz() if j==i else qutip.qeye(2) for j in range(num_qubit)])
-        for j in range(i+1,num_qubit):
-            if i+len==j or i+1==j:
-                sx_j=qutip.tensor([qutip.sigmax() if j==k else qutip.qeye(2) for k in range(num_qubit)])
-                sy_j=qutip.tensor([qutip.sigmay() if j==k else qutip.qeye(2) for k in range(num_qubit)])
-                sz_j=qutip.tensor([qutip.sigmaz() if j==k else qutip.qeye(2) for k in range(num_qubit)])
-                space_dependentH = space_dependentH + sx_i * sx_j + sy_i * sy_j + sz_i * sz_j * J
-        x = i%len
-        y = i//len
-        obs_sum = obs_sum + sy_i
-        space_dependentH = space_dependentH + (gradx*x +grady*y)*sz_i
-
-if option=="Sine Wave":
-    def periodic (t, args):
-        H = B0+amp*np.sin(2*np.pi*f*t)
-        if noise==True:
-            H = H+noise_interp(t)
-        return H
-if option=="Square Wave":
-    def periodic (t, args):
-        H = B0+amp*signal.square(2*np.pi*f*t, duty)
-        if noise==True:
-            H = H+noise_interp(t)
-        return H
-if option=="Sawtooth Wave":
-    def periodic (t, args):
-        H = B0+amp*signal.sawtooth(2*np.pi*f*(t+1/f), w)
-        if noise==True:
-            H = H+noise_interp(t)
-        return H
+    if noise_color == "Ornstein-Uhlenbeck":
+        tau = st.select_slider(
+        "Correlation Time (s)",
+        options=[
+            0.001,
+            0.01,
+            0.1,
+            1.0
+        ],)
 
 open = st.checkbox("Open Quantum System")
 
-c_ops = []
+decoherence_type = None
+gamma = 0
 if open == True:
     decoherence_type = st.radio(
         "Select Decoherence Type",
@@ -325,44 +363,143 @@ if open == True:
         4.0
 
     ],)
-    if decoherence_type in ["Amplitude Damping", "Both"]:
-        amp_op = np.sqrt(gamma) * qutip.tensor([qutip.destroy(2)] * num_qubit)
-        c_ops.append(amp_op)
-    if decoherence_type in ["Phase Damping", "Both"]:
-        phase_op = np.sqrt(gamma) * qutip.tensor([qutip.sigmaz()] * num_qubit)
-        c_ops.append(phase_op)
-    #c_ops = [np.sqrt(gamma) * qutip.sigmaz()]
 
 observable = st.radio("Choose an observable to measure",
         [r"$\bigotimes_{i=1}^N\sigma_y^{(i)}$", r"$\sum_{i=1}^N\sigma_y^{(i)}$"]
                       )
-if observable == r"$\bigotimes_{i=1}^N\sigma_y^{(i)}$":
-    obs=[qutip.tensor([qutip.sigmay()]*num_qubit)]
-else:
-    obs = obs_sum
 
+params = engine.make_params(
+    dim="1D" if dim == "***1D Chain***" else "2D",
+    num_qubit=num_qubit,
+    B0=B0,
+    amp=amp,
+    f=f,
+    J=J,
+    T=T,
+    grad=grad if dim == "***1D Chain***" else 0,
+    gradx=gradx if dim != "***1D Chain***" else 0,
+    grady=grady if dim != "***1D Chain***" else 0,
+    waveform={"Sine Wave": "sine", "Square Wave": "square", "Sawtooth Wave": "sawtooth"}[option],
+    duty=duty if option == "Square Wave" else 0.5,
+    w=w if option == "Sawtooth Wave" else 1.0,
+    noise_std=std if noise == True else 0,
+    noise_seed=st.session_state.noise_seed,
+    noise_color={"White": "white", "Pink": "pink", "Brown": "brown", "Ornstein-Uhlenbeck": "ou"}[noise_color],
+    noise_tau=tau,
+    decoherence={None: None, "Amplitude Damping": "amplitude", "Phase Damping": "phase", "Both": "both"}[decoherence_type],
+    gamma=gamma,
+    observable="prod" if observable == r"$\bigotimes_{i=1}^N\sigma_y^{(i)}$" else "sum",
+    initstate=initstate,
+    size=size,
+    periodic=periodic,
+)
 
+st.header("Sonification", divider=True)
+output = st.radio(
+    "Output",
+    ["***Mono***", "***Stereo voices***"],
+    captions=[
+        "The observable chosen above as a single track.",
+        "Several observables from the same simulation, panned from left to right in the order chosen.",
+    ],
+)
+mix = None
+if output == "***Stereo voices***":
+    voices = {}
+    for i in range(num_qubit):
+        for axis in "xyz":
+            voices[f"σ{axis} on spin {i+1}"] = f"{axis}{i}"
+    for i, j in sorted({tuple(sorted(bond)) for bond in lattice.Lattice(*params.size, params.periodic).bonds}):
+        voices[f"σz σz on spins {i+1}-{j+1}"] = f"z{i}z{j}"
+    voices["Parity"] = "parity"
+    chosen = st.multiselect(
+        "Voices",
+        list(voices),
+        default=[f"σy on spin {i+1}" for i in range(num_qubit)],
+    )
+    if chosen:
+        mix = engine.make_mix([voices[label] for label in chosen])
+    else:
+        st.warning("Choose at least one voice, otherwise the mono track is produced.")
+
+#Renders this session started for settings it has since moved away from are dropped
+pool = render_pool()
+pool.release(st.session_state.session_id, keep=engine.render_key(params, mix))
 
 Produce = st.button("Produce Sound")
-if Produce == True:
-    with st.status("Producing...", expanded=False) as status:
-        psi = qutip.Qobj(initstate, dims=[[2]*num_qubit, [1]*num_qubit])
-        H = qutip.QobjEvo([[qutip.tensor([qutip.sigmaz()]*num_qubit), periodic],space_dependentH], tlist=times)
-        result = qutip.mesolve(H, psi, times, c_ops, obs)
-        expectation=result.expect[0]
-        st.audio(expectation, sample_rate=44100)
-        audio=np.int16(expectation/np.max(np.abs(expectation))*32767)
-        buffer = io.BytesIO()
-        sf.write(buffer, audio, samplerate=44100, format='WAV', subtype='PCM_16')
-        buffer.seek(0)
+live = st.checkbox("Live preview", value=True, help="Plays the first half second at a lower sample rate as soon as a setting changes, while the full sound renders in the background.")
+profile = st.checkbox("Profile this render", help="Renders again on Produce Sound, even if the sound is cached, and shows where the time went.")
+file_format = st.selectbox(
+    "Audio Format",
+    ("FLAC", "WAV 16-bit", "WAV 24-bit", "WAV 8-bit", "Ogg Vorbis", "Opus"),)
+fmt = {"FLAC": "flac", "WAV 16-bit": "wav", "WAV 24-bit": "wav24", "WAV 8-bit": "wav8",
+       "Ogg Vorbis": "ogg", "Opus": "opus"}[file_format]
+_, _, mime, extension = engine.FORMATS[fmt]
+if Produce == True or live == True:
+    with st.status("Producing...", expanded=True) as status:
+        player = st.empty()
+        result = None
+        profile_path = None
+        if profile == True and Produce == True:
+            profile_path = os.path.join(tempfile.gettempdir(), f"qmusic-{uuid.uuid4().hex}.prof")
+        else:
+            result = engine.lookup(params, session_cache=st.session_state.render_cache, bank=sound_bank(), mix=mix)
+        fresh = result is None
+        if result is None:
+            #The full render starts first so the preview does not hold it up
+            job = pool.submit(params, st.session_state.session_id, mix=mix, profile=profile_path)
+            if live == True:
+                #Replaced by the full render once it is done; moving a slider cancels that render
+                sketch = engine.render_preview(params, mix=mix)
+                player.audio(sketch.encode("wav"), format="audio/wav")
+        while result is None:
+            progress = st.progress(0.0)
+            checkpoint = 0
+            while not job.done():
+                ahead = pool.position(job)
+                if ahead is not None:
+                    status.update(label=f"Waiting for a free worker ({ahead} render(s) ahead of yours)...")
+                else:
+                    done = pool.done_samples(job)
+                    status.update(label=f"Producing... {100*done//job.total}%")
+                    progress.progress(done/job.total)
+                    # Refresh the player at doubling lengths so early audio is
+                    # playable without re-sending the whole file every poll.
+                    if live == False and done >= 2*checkpoint and done > 0:
+                        partial = pool.partial_wav(job)
+                        if partial is not None:
+                            checkpoint = done
+                            player.audio(partial, format="audio/wav")
+                time.sleep(0.2)
+            progress.progress(1.0)
+            result = job.result()
+            if result is None:
+                job = pool.submit(params, st.session_state.session_id, mix=mix, profile=profile_path)
+        engine.remember(params, result, session_cache=st.session_state.render_cache, mix=mix)
+        audio = result.encode(fmt)
+        player.audio(audio, format=mime)
+        if fresh and result.stats:
+            st.markdown(f"Rendered in {result.stats['seconds']:.2f} s, peak memory {result.stats['peak_rss_bytes']/2**20:.0f} MiB")
+            plan = result.stats.get("notes", {}).get("resample")
+            if plan is not None and plan["stride"] > 1:
+                st.markdown(f"Solved at {plan['rate']:.0f} Hz, 1/{plan['stride']} of the audio rate, and resampled with an error of at most {plan['bound']:.1e}")
+            st.table({
+                "Stage": list(result.stats["stages"]),
+                "Seconds": [f"{stage['seconds']:.3f}" for stage in result.stats["stages"].values()],
+                "Calls": [stage["calls"] for stage in result.stats["stages"].values()],
+                "Memory growth (MiB)": [f"{stage['rss_growth_bytes']/2**20:.1f}" for stage in result.stats["stages"].values()],
+            })
+            if result.stats["profile"] and os.path.exists(result.stats["profile"]):
+                report = io.StringIO()
+                pstats.Stats(result.stats["profile"], stream=report).sort_stats("cumulative").print_stats(25)
+                st.code(report.getvalue())
         st.download_button(
-        label="Download WAV file",
-        data=buffer,
-        file_name="Sound of Larmor Precession.WAV",
-        mime="audio",
+        label=f"Download {file_format} file",
+        data=audio,
+        file_name=f"Sound of Larmor Precession.{extension}",
+        mime=mime,
         icon=":material/download:",
         )
         status.update(
         label="Completed!", state="complete", expanded=True
     )
-